@@ -1,23 +1,18 @@
 import pandas as pd
 from sklearn.ensemble import IsolationForest
-from datetime import datetime, timedelta
 import re
+from time_utils import parse_event_times, to_utc
+from rolling_windows import ROLLING_WINDOWS, rolling_window_features
 
 # Load the data
 data = pd.read_csv("path/to/data.csv")
 
 # Convert date columns to datetime
-data['REPORT_DATE'] = pd.to_datetime(data['REPORT_DATE'])
-data['EVENT_TIME'] = pd.to_datetime(data['EVENT_TIME'])
+data['REPORT_DATE'] = parse_event_times(data['REPORT_DATE'])
+data['EVENT_TIME'] = parse_event_times(data['EVENT_TIME'])
 
-# Normalize timezones (assuming the `TIMEZONE` column contains UTC offsets like "+02:00")
-def normalize_time(row):
-    try:
-        return row['EVENT_TIME'].tz_localize(row['TIMEZONE']).astimezone(datetime.timezone.utc)
-    except Exception:
-        return row['EVENT_TIME']
-
-data['EVENT_TIME_UTC'] = data.apply(normalize_time, axis=1)
+# Normalize timezones (the `TIMEZONE` column holds UTC offsets like "-4.0" or "+02:00")
+data['EVENT_TIME_UTC'] = to_utc(data['EVENT_TIME'], data['TIMEZONE'])
 
 # Extract numerical parts from USER_NAME for variation analysis
 data['NUMERIC_PART'] = data['USER_NAME'].apply(lambda x: int(re.sub(r'\D', '', x)) if re.search(r'\d', x) else 0)
@@ -34,15 +29,22 @@ data = data.merge(user_login_profiles, on='USER_ID', how='left')
 # Compute deviation from the user's average login hour
 data['hour_deviation'] = abs(data['EVENT_TIME_UTC'].dt.hour - data['avg_login_hour'])
 
+# Sliding-window features: attempts per user, distinct users and failures per IP in the last w seconds
+failed = data['EVENT_TYPE'] != 'successful_login' if 'EVENT_TYPE' in data.columns else None
+data = rolling_window_features(data, ROLLING_WINDOWS, failed=failed)
+
 # Feature for multiple login attempts within 1 second
-data['login_burst'] = data.groupby(['USER_ID', 'EVENT_TIME_UTC']).cumcount() + 1
+data['login_burst'] = data['ATTEMPTS_PER_USER_1S']
 
 # Feature for multiple users logging in from the same IP in a short timeframe
-ip_group = data.groupby(['IP_ADDRESS', pd.Grouper(key='EVENT_TIME_UTC', freq='1S')])
-data['users_per_ip'] = ip_group['USER_ID'].transform('nunique')
+data['users_per_ip'] = data['USERS_PER_IP_1S']
 
 # Features for anomaly detection
-anomaly_features = ['hour_deviation', 'NUMERIC_PART', 'login_burst', 'users_per_ip']
+longer_windows = [window for window in ROLLING_WINDOWS if window != 1]
+window_features = [f'ATTEMPTS_PER_USER_{w}S' for w in longer_windows] + [f'USERS_PER_IP_{w}S' for w in longer_windows]
+if failed is not None:
+    window_features += [f'FAILURES_PER_IP_{w}S' for w in ROLLING_WINDOWS]
+anomaly_features = ['hour_deviation', 'NUMERIC_PART', 'login_burst', 'users_per_ip'] + window_features
 
 # Fill NaNs (for cases where no deviations exist yet)
 data[anomaly_features] = data[anomaly_features].fillna(0)
@@ -1,143 +1,193 @@
 #!/usr/bin/env python3
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import IsolationForest
 from datetime import datetime
-import joblib
+from time_utils import parse_event_times, RSA_TIME_FORMAT
+from model_registry import ModelRegistry, isolation_forest_scores, N_JOBS
+from output_writer import write_frame
+from concurrent.futures import ThreadPoolExecutor
 import os
 
+FLAG_WORKERS = 4  # Flag detectors run side by side on threads (the data is shared, not copied)
+
 # Function to load the CSV data
 def load_data(file_path):
     """Loads the CSV data and parses the REPORT_DATE column."""
     data = pd.read_csv(file_path)
 
-    # Define date format to match bank data
-    date_format = "%d%b%Y:%H:%M:%S"
-
-    # error='coerce' will return NaT for any parsing errors
-    data['REPORT_DATE'] = pd.to_datetime(data['REPORT_DATE'], format=date_format, errors='coerce')
+    # Vectorized parse of the bank date format; unparseable values become NaT
+    data['REPORT_DATE'] = parse_event_times(data['REPORT_DATE'], formats=(RSA_TIME_FORMAT,))
 
     return data
 
 # Function to train and apply Isolation Forest
-def apply_isolation_forest(data, feature_columns, contamination=0.05, model_name="isolation_forest_model.pkl"):
-    """Trains Isolation Forest, saves the model, and predicts anomalies."""
+def apply_isolation_forest(data, feature_columns, contamination=0.05, model_name="isolation_forest_model.pkl", window="all",
+                           registry=None, n_jobs=N_JOBS):
+    """Scores data with the registry's Isolation Forest for this flag, retraining it when stale or the features changed.
+
+    Returns a copy of ``data`` with ``anomaly_score`` (-1 = anomaly) and ``anomaly_decision``;
+    the input is never modified, so several flags can score shared frames concurrently.
+    """
     # Check for NaN values in feature columns
     if data[feature_columns].isna().any().any():
         raise ValueError(f"Input data contains NaN values in columns: {feature_columns}. Please handle missing values before calling Isolation Forest.")
 
-    # Check if the model already exists
-    if os.path.exists(model_name):
-        print(f"Loading saved Isolation Forest model: {model_name}")
-        model = joblib.load(model_name)
-    else:
-        # Train a new Isolation Forest model
-        print(f"Training new Isolation Forest model and saving it as: {model_name}")
-        model = IsolationForest(contamination=contamination, random_state=42)
-        model.fit(data[feature_columns])
-
-        # Save the trained model
-        joblib.dump(model, model_name)
-
-    # Predict anomalies
-    data['anomaly_score'] = model.predict(data[feature_columns])
-    return data
+    # Models are keyed by flag name + feature schema + training window, fitted on n_jobs cores, scored in chunks
+    detector = os.path.splitext(model_name)[0]
+    labels, scores = isolation_forest_scores(detector, data, feature_columns, window=window,
+                                             contamination=contamination, registry=registry, n_jobs=n_jobs)
+    return data.assign(anomaly_score=labels, anomaly_decision=scores)
+
+# Shared feature extraction for every flag
+def extract_flag_features(data):
+    """
+    Computes the per-row, per-IP, per-user and per-(user, minute) features of all flags in one stage.
+
+    USER_ID and IP_ADDRESS are factorized once; every aggregate is a groupby on
+    those integer codes, and the flags map their results back to rows through
+    the same codes instead of re-grouping the frame or joining with ``isin``.
+    The row-level columns (USER_NAME_HASH, LOGIN_HOUR, time_bucket) are added
+    to ``data`` here, before any flag runs, so the flags only read it.
+
+    Returns:
+        dict: Feature tables and row-aligned code arrays shared by the flags.
+    """
+    user_codes, users = pd.factorize(data['USER_ID'])
+    ip_codes, ips = pd.factorize(data['IP_ADDRESS'])
+
+    # Row-level features (stable hash, so saved models mean the same thing in every run)
+    data['USER_NAME_HASH'] = pd.util.hash_array(data['USER_NAME'].astype(str).to_numpy(object)).view(np.int64)
+    data['LOGIN_HOUR'] = data['REPORT_DATE'].dt.hour
+    data['time_bucket'] = data['REPORT_DATE'].dt.floor('1min')  # Bucket by minute
+
+    # Flag 2: unique users per IP
+    known_users = pd.Series(user_codes).where(user_codes >= 0)
+    unique_users = known_users.groupby(ip_codes).nunique().reindex(range(len(ips)))
+    per_ip = pd.DataFrame({'IP_ADDRESS': ips, 'UNIQUE_USERS': unique_users.to_numpy()})
+
+    # Flag 3: regular login hours per user (noon / no deviation when unknown)
+    hours = data['LOGIN_HOUR'].groupby(user_codes).agg(['mean', 'std']).reindex(range(len(users)))
+    per_user = pd.DataFrame({'USER_ID': users,
+                             'AVG_LOGIN_HOUR': hours['mean'].fillna(12).to_numpy(),
+                             'HOUR_DEVIATION': hours['std'].fillna(0).to_numpy()})
+
+    # Flag 4: attempts per user per minute
+    minutes = pd.DataFrame({'USER_CODE': user_codes, 'time_bucket': data['time_bucket'].to_numpy()})
+    minutes = minutes[minutes['USER_CODE'] >= 0]
+    per_user_minute = minutes.groupby(['USER_CODE', 'time_bucket']).size().reset_index(name='ATTEMPT_COUNT')
+
+    return {
+        'user_codes': user_codes,
+        'ip_codes': ip_codes,
+        'successful_login': (data['EVENT_TYPE'] == 'successful_login').to_numpy(),
+        'per_ip': per_ip,
+        'per_user': per_user,
+        'per_user_minute': per_user_minute,
+    }
+
+def _rows_with_codes(codes, flagged_codes, n_codes):
+    """Boolean row mask for the rows whose code is one of ``flagged_codes``."""
+    flagged = np.zeros(n_codes + 1, dtype=bool)  # Last slot stands for missing keys (code -1)
+    flagged[np.asarray(flagged_codes, dtype=np.int64)] = True
+    flagged[-1] = False
+    return flagged[codes]
 
 # Flag 1: Detect username variations with Isolation Forest
-def detect_username_variations(data):
+def detect_username_variations(data, features=None, contamination=0.05, registry=None, n_jobs=N_JOBS):
     """Uses Isolation Forest to detect username variations."""
-    # Feature: USER_NAME encoded to numerical hashes
-    data['USER_NAME_HASH'] = data['USER_NAME'].apply(hash).astype(np.int64)
-    feature_columns = ['USER_NAME_HASH']
+    features = features if features is not None else extract_flag_features(data)
 
-    # Use a unique model name for Flag 1
+    # Feature: USER_NAME encoded to numerical hashes (scored on a narrow frame, the full data is only read)
     model_name = "flag1_username_variations.pkl"
-    flagged_data = apply_isolation_forest(data, feature_columns, model_name=model_name)
-    anomalies = flagged_data[flagged_data['anomaly_score'] == -1]
+    flagged_data = apply_isolation_forest(data[['USER_NAME_HASH']], ['USER_NAME_HASH'], contamination=contamination,
+                                          model_name=model_name, registry=registry, n_jobs=n_jobs)
+    anomalies = (flagged_data['anomaly_score'] == -1).to_numpy()
 
     # Filter for successful logins
-    flagged_anomalies = anomalies[anomalies['EVENT_TYPE'] == 'successful_login']
-    return flagged_anomalies
+    return data[anomalies & features['successful_login']]
 
 # Flag 2: Detect multiple users logging in from the same IP
-def detect_multiple_users_same_ip(data, contamination=0.05):
+def detect_multiple_users_same_ip(data, features=None, contamination=0.05, registry=None, n_jobs=N_JOBS):
     """Uses Isolation Forest to detect multiple users from the same IP address."""
-    # Group data by IP and count unique USER_IDs per IP
-    ip_grouped = data.groupby('IP_ADDRESS').agg({'USER_ID': 'nunique'}).reset_index()
-    ip_grouped.columns = ['IP_ADDRESS', 'UNIQUE_USERS']
+    features = features if features is not None else extract_flag_features(data)
+    ip_grouped = features['per_ip']
 
     # Use a unique model name for Flag 2
     model_name = "flag2_multiple_users_same_ip.pkl"
-    flagged_data = apply_isolation_forest(ip_grouped, feature_columns=['UNIQUE_USERS'], contamination=contamination, model_name=model_name)
-    anomalies = flagged_data[flagged_data['anomaly_score'] == -1]
+    flagged_data = apply_isolation_forest(ip_grouped, feature_columns=['UNIQUE_USERS'], contamination=contamination,
+                                          model_name=model_name, registry=registry, n_jobs=n_jobs)
+    flagged_ips = np.flatnonzero(flagged_data['anomaly_score'].to_numpy() == -1)
 
     # Match anomalies with the original dataset
-    flagged_ips = anomalies['IP_ADDRESS'].tolist()
-    flagged_rows = data[data['IP_ADDRESS'].isin(flagged_ips) & (data['EVENT_TYPE'] == 'successful_login')]
-    return flagged_rows
+    rows = _rows_with_codes(features['ip_codes'], flagged_ips, len(ip_grouped))
+    return data[rows & features['successful_login']]
 
 # Flag 3: Detect logins outside regular hours
-def detect_logins_outside_regular_hours(data, contamination=0.05):
+def detect_logins_outside_regular_hours(data, features=None, contamination=0.05, registry=None, n_jobs=N_JOBS):
     """Uses Isolation Forest to detect logins outside of regular hours."""
-    # Extract hour from REPORT_DATE
-    data['LOGIN_HOUR'] = data['REPORT_DATE'].dt.hour
-
-    # Learn regular login hours for each user
-    user_grouped = data.groupby('USER_ID').agg({'LOGIN_HOUR': 'mean'}).reset_index()
-    user_grouped.columns = ['USER_ID', 'AVG_LOGIN_HOUR']
-
-    # Add deviation feature
-    user_grouped['HOUR_DEVIATION'] = data.groupby('USER_ID').LOGIN_HOUR.std()
-
-    # Ensure only numeric columns are used
-    numeric_columns = ['AVG_LOGIN_HOUR', 'HOUR_DEVIATION']
-
-    # Debug: Check for NaN values before handling them
-    print("Before handling NaN values:")
-    print(user_grouped.isna().sum())
-
-    # Fill missing values with defaults
-    user_grouped['AVG_LOGIN_HOUR'].fillna(12, inplace=True)  # Default to noon if no mean login hour
-    user_grouped['HOUR_DEVIATION'].fillna(0, inplace=True)  # Default to 0 if no deviation exists
-
-    # Debug: Check for remaining NaN values after filling
-    print("After handling NaN values:")
-    print(user_grouped.isna().sum())
+    features = features if features is not None else extract_flag_features(data)
+    user_grouped = features['per_user']
 
     # Use a unique model name for Flag 3
     model_name = "flag3_login_hours.pkl"
-    flagged_data = apply_isolation_forest(user_grouped, feature_columns=numeric_columns, contamination=contamination, model_name=model_name)
-    anomalies = flagged_data[flagged_data['anomaly_score'] == -1]
+    flagged_data = apply_isolation_forest(user_grouped, feature_columns=['AVG_LOGIN_HOUR', 'HOUR_DEVIATION'],
+                                          contamination=contamination, model_name=model_name, registry=registry,
+                                          n_jobs=n_jobs)
+    flagged_users = np.flatnonzero(flagged_data['anomaly_score'].to_numpy() == -1)
 
     # Match anomalies back to original data
-    flagged_users = anomalies['USER_ID'].tolist()
-    flagged_rows = data[data['USER_ID'].isin(flagged_users)]
-    return flagged_rows
+    return data[_rows_with_codes(features['user_codes'], flagged_users, len(user_grouped))]
 
 # Flag 4: Detect excessive login attempts
-def detect_excessive_login_attempts(data, contamination=0.05):
+def detect_excessive_login_attempts(data, features=None, contamination=0.05, registry=None, n_jobs=N_JOBS):
     """Uses Isolation Forest to detect excessive login attempts."""
-    # Create a feature for login attempts in 1-minute windows
-    data['time_bucket'] = data['REPORT_DATE'].dt.floor('1T')  # Bucket by minute
-    user_grouped = data.groupby(['USER_ID', 'time_bucket']).size().reset_index(name='ATTEMPT_COUNT')
+    features = features if features is not None else extract_flag_features(data)
+    user_grouped = features['per_user_minute']
 
     # Use a unique model name for Flag 4
     model_name = "flag4_excessive_login_attempts.pkl"
-    flagged_data = apply_isolation_forest(user_grouped, feature_columns=['ATTEMPT_COUNT'], contamination=contamination, model_name=model_name)
-    anomalies = flagged_data[flagged_data['anomaly_score'] == -1]
+    flagged_data = apply_isolation_forest(user_grouped, feature_columns=['ATTEMPT_COUNT'], contamination=contamination,
+                                          model_name=model_name, registry=registry, n_jobs=n_jobs)
+    flagged_users = flagged_data.loc[flagged_data['anomaly_score'] == -1, 'USER_CODE'].unique()
 
     # Match anomalies back to original data
-    flagged_users = anomalies['USER_ID'].tolist()
-    flagged_rows = data[data['USER_ID'].isin(flagged_users)]
-    return flagged_rows
+    return data[_rows_with_codes(features['user_codes'], flagged_users, len(features['per_user']))]
+
+# Run every flag on the shared features at once
+def run_flag_detectors(data, features, detectors, max_workers=FLAG_WORKERS):
+    """Runs the flag detectors concurrently on threads over the read-only ``data`` and ``features``."""
+    registry = ModelRegistry()  # One registry shared by all threads
+    n_jobs = max(1, (os.cpu_count() or 1) // max_workers)  # Cores split between the concurrent fits
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(detector, data, features, registry=registry, n_jobs=n_jobs)
+                   for detector in detectors]
+        return [future.result() for future in futures]
+
+# Build the per-user flag summary
+def build_flag_summary(data, flag_frames, report_date, n_flags=6):
+    """
+    Counts each user's rows in every flag frame with one value_counts per flag.
+
+    Users appear in order of first appearance in ``data`` with the IP of their
+    first row; flags without a detector yet (Flag_5, Flag_6) are left empty.
+    """
+    first_rows = data.drop_duplicates('USER_ID')
+    users = first_rows['USER_ID']
+    summary = pd.DataFrame({'USR_ID': users.to_numpy()})
+    for flag, flag_data in enumerate(flag_frames, start=1):
+        counts = flag_data['USER_ID'].value_counts(dropna=False)
+        summary[f'Flag_{flag}'] = users.map(counts).fillna(0).astype(np.int64).to_numpy()
+    for flag in range(len(flag_frames) + 1, n_flags + 1):
+        summary[f'Flag_{flag}'] = None  # Placeholder
+    summary['User_IP'] = first_rows['IP_ADDRESS'].to_numpy()
+    summary['Date'] = report_date
+    return summary
 
 # Save results to files
 def save_results(fraud_data, summary_data, report_date):
-    """Saves fraud detection results and summary to CSV files."""
-    fraud_file = f"Fraud_{report_date}.csv"
-    summary_file = f"Summary_{report_date}.csv"
-    fraud_data.to_csv(fraud_file, index=False)
-    summary_data.to_csv(summary_file, index=False)
+    """Saves fraud detection results and summary as compressed columnar outputs (see output_writer)."""
+    fraud_file = write_frame(fraud_data, f"Fraud_{report_date}")
+    summary_file = write_frame(summary_data, f"Summary_{report_date}")
     print(f"Saved fraud report to {fraud_file}")
     print(f"Saved summary report to {summary_file}")
 
@@ -147,32 +197,23 @@ def main(input_file):
     data = load_data(input_file)
     report_date = data['REPORT_DATE'].iloc[0].strftime('%Y-%m-%d')
 
-    # Initialize summary dictionary
-    summary = {'USR_ID': [], 'Flag_1': [], 'Flag_2': [], 'Flag_3': [], 'Flag_4': [], 'Flag_5': [], 'Flag_6': [], 'User_IP': [], 'Date': []}
-
-    # Apply Isolation Forest for each flag
-    flag1_data = detect_username_variations(data)
-    flag2_data = detect_multiple_users_same_ip(data)
-    flag3_data = detect_logins_outside_regular_hours(data)
-    flag4_data = detect_excessive_login_attempts(data)
+    # Extract every flag's features in one stage, then apply Isolation Forest for each flag concurrently
+    features = extract_flag_features(data)
+    flag1_data, flag2_data, flag3_data, flag4_data = run_flag_detectors(data, features, [
+        detect_username_variations,
+        detect_multiple_users_same_ip,
+        detect_logins_outside_regular_hours,
+        detect_excessive_login_attempts,
+    ])
 
     # Populate summary
-    for user_id in data['USER_ID'].unique():
-        summary['USR_ID'].append(user_id)
-        summary['Flag_1'].append(flag1_data['USER_ID'].tolist().count(user_id))
-        summary['Flag_2'].append(flag2_data['USER_ID'].tolist().count(user_id))
-        summary['Flag_3'].append(flag3_data['USER_ID'].tolist().count(user_id))
-        summary['Flag_4'].append(flag4_data['USER_ID'].tolist().count(user_id))
-        summary['Flag_5'].append(None)  # Placeholder
-        summary['Flag_6'].append(None)  # Placeholder
-        summary['User_IP'].append(data[data['USER_ID'] == user_id]['IP_ADDRESS'].iloc[0])
-        summary['Date'].append(report_date)
+    summary = build_flag_summary(data, [flag1_data, flag2_data, flag3_data, flag4_data], report_date)
 
     # Combine fraud reports
     fraud_reports = pd.concat([flag1_data, flag2_data, flag3_data, flag4_data], ignore_index=True)
 
     # Save results
-    save_results(fraud_reports, pd.DataFrame(summary), report_date)
+    save_results(fraud_reports, summary, report_date)
 
 if __name__ == "__main__":
     input_file = "/home/vaiosos/Documents/Holberton/Fraude-Detection-Project/Data/cleaned_RSA.csv"  # Replace with your actual file
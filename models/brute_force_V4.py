@@ -1,24 +1,18 @@
 import pandas as pd
 import numpy as np
-import hdbscan
-import re
 from datetime import datetime
-from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import IsolationForest
-
-def extract_numbers_and_clean(username):
-    """
-    Extracts numerical values from a username and returns the cleaned username.
-
-    Parameters:
-        username (str): The username to process.
-
-    Returns:
-        tuple: (cleaned username, extracted numbers as a concatenated string)
-    """
-    numbers = ''.join(re.findall(r'\d+', username))  # Extract numerical values
-    cleaned_id = re.sub(r'\d+', '', username)  # Remove numbers from username
-    return cleaned_id, numbers
+from time_utils import parse_event_times
+from cardinality import users_per_ip
+from user_features import USER_FEATURES, user_feature_table, broadcast_to_events
+from reference_clusterer import cluster_with_reference
+from model_registry import isolation_forest_scores, training_window
+from output_writer import write_frame
+from username_index import UsernameIndex, decompose_usernames
+
+FIT_ONCE_HDBSCAN = True  # Score against a persisted reference HDBSCAN (refitted every REFIT_DAYS) instead of refitting per file
+HDBSCAN_PARAMS = {"min_cluster_size": 5, "min_samples": 2, "metric": "euclidean", "cluster_selection_method": "eom"}
+PROCESSED_OUTPUT = "processed_login_attempts"  # Output directories (read back with output_writer.read_output)
+ANOMALIES_OUTPUT = "detected_anomalies"
 
 def run_fraud_detection(auth_path, user_history):
     """
@@ -29,10 +23,17 @@ def run_fraud_detection(auth_path, user_history):
         user_history (dict): Output from the user history model containing user profiles.
 
     Saves:
-        - processed_login_attempts.csv (Preprocessed login data)
-        - detected_anomalies.csv (Flagged anomalies)
+        - processed_login_attempts/ (Preprocessed login data, see output_writer)
+        - detected_anomalies/ (Flagged anomalies)
     """
+    # Heavy libraries are only loaded when the detection actually runs
+    import hdbscan
+    from sklearn.preprocessing import StandardScaler
+
     try:
+        # Known usernames by base, so step 1 is a lookup per attempt
+        username_index = UsernameIndex.from_users(user_history.keys())
+
         # Load authentication log
         df_auth = pd.read_csv(auth_path)
 
@@ -42,30 +43,24 @@ def run_fraud_detection(auth_path, user_history):
             raise ValueError(f"CSV file must contain columns: {required_columns}")
 
         # Convert EVENT_DATE to datetime format
-        df_auth["EVENT_DATE"] = pd.to_datetime(df_auth["EVENT_DATE"], format="%d%b%Y:%H:%M:%S")
+        df_auth["EVENT_DATE"] = parse_event_times(df_auth["EVENT_DATE"])
 
-        # Extract numbers from USERNAME for anomaly detection
-        df_auth["CLEANED_USERNAME"], df_auth["EXTRACTED_NUMBERS"] = zip(*df_auth["USERNAME"].apply(extract_numbers_and_clean))
+        # Split USERNAME into base, digits and digit layout for anomaly detection (vectorized)
+        df_auth = df_auth.join(decompose_usernames(df_auth["USERNAME"]))
 
         ### 📌 **1️⃣ Detect Numerical Value Attacks (Guessing Usernames)**
+        # Each distinct (base, numbers) attempt is one lookup in the username index
         df_invalid_usernames = df_auth[df_auth["EVENT"] == "INVALID_USERNAME"]
-        attacked_users = set()
-
-        for _, row in df_invalid_usernames.iterrows():
-            attempted_username = row["CLEANED_USERNAME"]
-            attempted_numbers = row["EXTRACTED_NUMBERS"]
-
-            for user_id in user_history.keys():
-                cleaned_user_id, extracted_numbers = extract_numbers_and_clean(user_id)
-
-                if cleaned_user_id == attempted_username and attempted_numbers != extracted_numbers:
-                    attacked_users.add(user_id)
+        attempts = df_invalid_usernames[["CLEANED_USERNAME", "EXTRACTED_NUMBERS"]].drop_duplicates()
+        attacked_users = username_index.attacked_users(attempts.itertuples(index=False, name=None))
 
         print(f"\n🔍 Numerical value attack detected on: {attacked_users}")
 
         ### 📌 **2️⃣ Detect Multiple Users Logging in from the Same IP**
-        ip_attempt_counts = df_auth.groupby("IP")["USERNAME"].nunique()
-        suspicious_ips = ip_attempt_counts[ip_attempt_counts > 3].index.tolist()
+        # Distinct users per IP in sliding 1 min / 10 min / 1 h windows (HyperLogLog, bounded memory),
+        # so a bot spraying accounts in minutes stands out from an office NAT over a whole day
+        users_per_ip(df_auth)
+        suspicious_ips = df_auth.loc[df_auth["USERS_PER_IP_600S"] > 3, "IP"].unique().tolist()
         print(f"\n⚠️ Multiple users logging in from the same IP detected: {suspicious_ips}")
 
         ### 📌 **3️⃣ Detect Brute-Force Attacks (Repeated Attempts in Short Time)**
@@ -82,40 +77,41 @@ def run_fraud_detection(auth_path, user_history):
         print(account_changes[["USERNAME", "EVENT", "EVENT_DATE"]])
 
         ### 📌 **5️⃣ HDBSCAN for Outlier Detection**
-        df_auth["LOGIN_COUNT"] = df_auth.groupby("USERNAME")["USERNAME"].transform("count")
-        df_auth["UNIQUE_IP_COUNT"] = df_auth.groupby("USERNAME")["IP"].transform("nunique")
-        df_auth["AVG_TIME_DIFF"] = df_auth.groupby("USERNAME")["TIME_DIFF"].transform("mean")
-
-        # Prepare data for clustering
-        features = ["LOGIN_COUNT", "UNIQUE_IP_COUNT", "AVG_TIME_DIFF"]
-        df_auth[features] = df_auth[features].fillna(0)  # Handle missing values
+        # Models are fitted on one row per user, then the labels are broadcast back to the events
+        user_features = user_feature_table(df_auth)
+
+        # Run HDBSCAN clustering (against the persisted reference clusters, or refitted on this file)
+        if FIT_ONCE_HDBSCAN:
+            clusters = cluster_with_reference("auth_users", user_features, USER_FEATURES, HDBSCAN_PARAMS)
+            user_features["HDBSCAN_CLUSTER"] = clusters["HDBSCAN_CLUSTER"]
+            user_features["HDBSCAN_OUTLIER_SCORE"] = clusters["HDBSCAN_OUTLIER_SCORE"]
+        else:
+            user_features_scaled = StandardScaler().fit_transform(user_features[USER_FEATURES])
+            clusterer = hdbscan.HDBSCAN(**HDBSCAN_PARAMS)
+            user_features["HDBSCAN_CLUSTER"] = clusterer.fit_predict(user_features_scaled)
+            user_features["HDBSCAN_OUTLIER_SCORE"] = clusterer.outlier_scores_
 
-        scaler = StandardScaler()
-        df_auth_scaled = scaler.fit_transform(df_auth[features])
+        ### 📌 **6️⃣ Isolation Forest for Anomaly Detection**
+        # Reused from the model registry within a training window; retrained for a new window or schema
+        window = training_window(df_auth["EVENT_DATE"])
+        user_features["ISOLATION_SCORE"], user_features["ISOLATION_DECISION"] = isolation_forest_scores(
+            "auth_users", user_features, USER_FEATURES, window=window, contamination=0.05)
 
-        # Run HDBSCAN clustering
-        clusterer = hdbscan.HDBSCAN(min_cluster_size=5, min_samples=2, metric="euclidean", cluster_selection_method="eom")
-        df_auth["HDBSCAN_CLUSTER"] = clusterer.fit_predict(df_auth_scaled)
+        broadcast_to_events(df_auth, user_features, USER_FEATURES + ["HDBSCAN_CLUSTER", "HDBSCAN_OUTLIER_SCORE", "ISOLATION_SCORE", "ISOLATION_DECISION"])
 
-        # Mark HDBSCAN outliers (cluster -1)
+        # Mark HDBSCAN outliers (cluster -1) and Isolation Forest outliers (-1 means anomaly)
         df_auth["HDBSCAN_ANOMALY"] = df_auth["HDBSCAN_CLUSTER"] == -1
-
-        ### 📌 **6️⃣ Isolation Forest for Anomaly Detection**
-        iso_forest = IsolationForest(contamination=0.05, random_state=42)
-        df_auth["ISOLATION_SCORE"] = iso_forest.fit_predict(df_auth_scaled)
-
-        # Mark Isolation Forest outliers (-1 means anomaly)
         df_auth["ISOLATION_ANOMALY"] = df_auth["ISOLATION_SCORE"] == -1
 
         ### 📌 **7️⃣ Flag Final Anomalies**
         df_auth["IS_ANOMALY"] = df_auth["HDBSCAN_ANOMALY"] | df_auth["ISOLATION_ANOMALY"]
 
-        # Save results
-        df_auth.to_csv("processed_login_attempts.csv", index=False)
+        # Save results (compressed columnar part files, one directory per EVENT_DATE day)
+        write_frame(df_auth, PROCESSED_OUTPUT, partition_by="EVENT_DATE")
         anomalies = df_auth[df_auth["IS_ANOMALY"]]
-        anomalies.to_csv("detected_anomalies.csv", index=False)
+        write_frame(anomalies, ANOMALIES_OUTPUT, partition_by="EVENT_DATE")
 
-        print("\n✅ Fraud detection complete! Check 'detected_anomalies.csv' for results.")
+        print(f"\n✅ Fraud detection complete! Check '{ANOMALIES_OUTPUT}/' for results.")
 
     except FileNotFoundError:
         print(f"\n❌ Error: The file '{auth_path}' was not found. Please check the path and try again.")
@@ -2,7 +2,7 @@ from brute_testing import run_fraud_detection  # Import your fraud detection fun
 
 # Define paths for the authentication log and user history
 AUTH_LOG_PATH = "/home/vaiosos/Documents/Holberton/Fraude-Detection-Project/Data/fake_auth_dataset.csv"
-USER_HISTORY_PATH = "/home/vaiosos/Documents/Holberton/Fraude-Detection-Project/models/user_history.pkl"
+USER_HISTORY_PATH = "/home/vaiosos/Documents/Holberton/Fraude-Detection-Project/models/user_history"
 
 # Run fraud detection using the given files
 if __name__ == "__main__":
@@ -0,0 +1,140 @@
+import os
+import json
+import pickle
+import shutil
+import tempfile
+import zlib
+
+# Crash-safe bookkeeping for long history builds
+CHECKPOINT_DIR = "build_checkpoint"
+JOURNAL_FILE = "journal.log"
+
+
+def atomic_write_pickle(obj, path):
+    """
+    Pickles ``obj`` to ``path`` so readers only ever see the old or the new file.
+
+    The data is written to a temporary file in the same directory, flushed to
+    disk and then swapped in with ``os.replace``, which is atomic on POSIX and
+    Windows. A crash mid-write leaves the previous file untouched.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".pkl", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def input_fingerprint(csv_path):
+    """Identifies an input file by path, size and modification time (a changed file starts over)."""
+    stat = os.stat(csv_path)
+    return f"{os.path.abspath(csv_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class BuildJournal:
+    """
+    Append-only write-ahead log of the buckets a history build has completed.
+
+    Every line is one JSON record, appended and fsynced only after the bucket's
+    shards were flushed, so a record always describes durable work. On open the
+    log is replayed: a torn last line (crash mid-append) is ignored and only the
+    records of the current input file count. ``finish`` truncates the log once
+    the whole file has been processed.
+
+    Parameters:
+        run_id (str): Fingerprint of the input file (see ``input_fingerprint``).
+        root (str): Directory holding the journal and the resumable partitions.
+
+    Example:
+        journal = BuildJournal(input_fingerprint(csv_path))
+        for idx, bucket in enumerate(partitions):
+            if journal.is_done(idx):
+                continue
+            ...
+            journal.mark_done(idx, changed=n)
+    """
+
+    def __init__(self, run_id, root=CHECKPOINT_DIR):
+        self.run_id = run_id
+        self.root = root
+        self.path = os.path.join(root, JOURNAL_FILE)
+        self.completed = {}  # bucket index -> users changed by that bucket
+        os.makedirs(root, exist_ok=True)
+        self._replay()
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        stale = False
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    stale = True  # Torn write: everything before it is intact
+                    break
+                if record.get("run") == self.run_id and record.get("event") == "bucket":
+                    self.completed[record["bucket"]] = record.get("changed", 0)
+                else:
+                    stale = True  # Left behind by an interrupted build of another file
+
+        # Rewrite the log without torn or foreign records so new appends start on a clean line
+        if stale:
+            self._rewrite()
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name.startswith("partitions_") and path != self.partition_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def _rewrite(self):
+        lines = [json.dumps({"event": "bucket", "bucket": bucket, "changed": changed, "run": self.run_id})
+                 for bucket, changed in sorted(self.completed.items())]
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".log", dir=self.root)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _append(self, record):
+        record["run"] = self.run_id
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @property
+    def resuming(self):
+        """True if an earlier, interrupted run of the same input completed some buckets."""
+        return bool(self.completed)
+
+    def partition_dir(self):
+        """Scratch directory whose buckets survive a crash so a rerun does not repartition."""
+        name = "partitions_" + format(zlib.crc32(self.run_id.encode("utf-8")), "08x")
+        return os.path.join(self.root, name)
+
+    def is_done(self, bucket):
+        return bucket in self.completed
+
+    def mark_done(self, bucket, changed=0):
+        """Records a bucket whose results are already durable in the history stores."""
+        self._append({"event": "bucket", "bucket": bucket, "changed": changed})
+        self.completed[bucket] = changed
+
+    def changed_users(self):
+        """Users changed across every completed bucket, including earlier interrupted runs."""
+        return sum(self.completed.values())
+
+    def finish(self):
+        """Clears the journal and the resumable partitions after a complete run."""
+        shutil.rmtree(self.partition_dir(), ignore_errors=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.completed = {}
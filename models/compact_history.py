@@ -0,0 +1,316 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from time_utils import parse_event_times
+from checkpoint import atomic_write_pickle
+
+# Shared string dictionaries live next to the history shards
+VOCAB_FILE = "vocabulary.pkl"
+TIME_COLUMN = "EVENT_TIME"
+MISSING_TIME = np.iinfo(np.int64).min  # Epoch value stored for unparseable EVENT_TIMEs
+
+# Storage kinds for a column
+TIME, CODE, INT, FLOAT = "time", "code", "int", "float"
+
+
+class Vocabulary:
+    """Shared string <-> integer code dictionaries, one per categorical column."""
+
+    def __init__(self):
+        self.codes = {}  # column -> {value: code}
+        self.values = {}  # column -> [value, ...] indexed by code
+        self.dirty = False
+
+    def encode(self, column, values):
+        """Returns int32 codes for ``values``, adding unseen values to the dictionary."""
+        codes = self.codes.setdefault(column, {})
+        known = self.values.setdefault(column, [])
+
+        # Factorize first so the dictionary is consulted once per distinct value, not per row
+        inverse, uniques = pd.factorize(pd.Series(values, dtype=object).astype(str), use_na_sentinel=False)
+        unique_codes = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques):
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(known)
+                known.append(value)
+                self.dirty = True
+            unique_codes[i] = code
+        return unique_codes[inverse]
+
+    def decode(self, column, codes):
+        """Maps integer codes back to their strings."""
+        return np.asarray(self.values.get(column, []), dtype=object)[codes]
+
+
+def load_vocabulary(vocab_path):
+    """Load the shared vocabulary if it exists, else return an empty one."""
+    if os.path.exists(vocab_path):
+        with open(vocab_path, "rb") as f:
+            vocab = pickle.load(f)
+        vocab.dirty = False
+        return vocab
+    return Vocabulary()
+
+
+def save_vocabulary(vocab, vocab_path):
+    """Save the shared vocabulary, but only if new values were added since the last save."""
+    if vocab.dirty:
+        atomic_write_pickle(vocab, vocab_path)
+        vocab.dirty = False
+
+
+def _epoch_seconds(values):
+    """Converts EVENT_TIME strings (or datetimes) to int64 epoch seconds."""
+    times = parse_event_times(values)
+    if getattr(times.dt, "tz", None) is not None:
+        times = times.dt.tz_convert("UTC").dt.tz_localize(None)
+    seconds = times.astype("datetime64[s]").to_numpy().astype(np.int64)
+    seconds[times.isna().to_numpy()] = MISSING_TIME
+    return seconds
+
+
+class CompactHistory:
+    """
+    A user's event history stored as typed numpy arrays instead of a DataFrame.
+
+    EVENT_TIME is kept as int64 epoch seconds, string columns as int32 codes
+    into a shared ``Vocabulary``, and numeric columns as compact integers or
+    float32. ``to_frame`` rebuilds a DataFrame only when one is really needed.
+    """
+
+    def __init__(self, columns, kinds, arrays):
+        self.columns = list(columns)
+        self.kinds = dict(kinds)
+        self.arrays = dict(arrays)
+
+    @classmethod
+    def from_frame(cls, df, vocab, like=None):
+        """
+        Encodes a DataFrame of events.
+
+        Parameters:
+            df (DataFrame): Events for one user (without USER_ID).
+            vocab (Vocabulary): Shared string dictionaries (updated in place).
+            like (CompactHistory): Optional history whose column kinds are reused,
+                                   so new batches always line up with stored ones.
+
+        Returns:
+            CompactHistory: The encoded history.
+        """
+        columns = like.columns if like is not None else list(df.columns)
+        kinds, arrays = {}, {}
+        for column in columns:
+            values = df[column] if column in df.columns else pd.Series([np.nan] * len(df), index=df.index)
+            kind = like.kinds[column] if like is not None else None
+
+            if kind is None:
+                if column == TIME_COLUMN:
+                    kind = TIME
+                elif pd.api.types.is_integer_dtype(values) or pd.api.types.is_bool_dtype(values):
+                    kind = INT
+                elif pd.api.types.is_numeric_dtype(values):
+                    kind = FLOAT
+                else:
+                    kind = CODE
+
+            if kind == TIME:
+                arrays[column] = _epoch_seconds(values)
+            elif kind == CODE:
+                arrays[column] = vocab.encode(column, values)
+            elif kind == INT:
+                numeric = pd.to_numeric(values, errors="coerce").fillna(0).astype(np.int64)
+                arrays[column] = pd.to_numeric(numeric, downcast="integer").to_numpy()
+            else:
+                arrays[column] = pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float32)
+            kinds[column] = kind
+        return cls(columns, kinds, arrays)
+
+    def __len__(self):
+        return len(self.arrays[self.columns[0]]) if self.columns else 0
+
+    @property
+    def nbytes(self):
+        """Bytes used by the stored arrays."""
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def append(self, other):
+        """Returns a new history with ``other``'s events after this one's."""
+        arrays = {}
+        for column in self.columns:
+            merged = np.concatenate([self.arrays[column], other.arrays[column]])
+            if self.kinds[column] == INT:
+                merged = pd.to_numeric(merged.astype(np.int64), downcast="integer")
+            arrays[column] = merged
+        return CompactHistory(self.columns, self.kinds, arrays)
+
+    def take(self, indices):
+        """Returns a new history with only the selected rows (positions or boolean mask)."""
+        return CompactHistory(self.columns, self.kinds,
+                              {column: array[indices] for column, array in self.arrays.items()})
+
+    def _canonical(self, column):
+        """Column values in a fixed dtype, so downcasting never changes a hash."""
+        kind = self.kinds[column]
+        if kind == INT:
+            return self.arrays[column].astype(np.int64)
+        if kind == FLOAT:
+            return self.arrays[column].astype(np.float64)
+        return self.arrays[column]
+
+    def row_hashes(self):
+        """Returns one uint64 hash per event over every column (spots re-delivered rows)."""
+        frame = pd.DataFrame({column: self._canonical(column) for column in self.columns})
+        return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+    def content_hash(self):
+        """Returns a digest of the whole history; equal digests mean identical training input."""
+        digest = hashlib.blake2b(digest_size=16)
+        for column in self.columns:
+            digest.update(column.encode("utf-8"))
+            digest.update(np.ascontiguousarray(self._canonical(column)).tobytes())
+        return digest.hexdigest()
+
+    def drop_known(self, known):
+        """Returns only the events that are not already in ``known`` (matched on every column)."""
+        if known is None or len(known) == 0 or len(self) == 0:
+            return self
+        return self.take(~np.isin(self.row_hashes(), known.row_hashes()))
+
+    def numeric_columns(self):
+        """Names of the columns that feed the models, in their original order."""
+        return [column for column in self.columns if self.kinds[column] in (INT, FLOAT)]
+
+    def numeric_matrix(self):
+        """Returns the (n_events, n_features) float64 matrix the HMM and sequence model train on."""
+        columns = self.numeric_columns()
+        if not columns:
+            return np.empty((len(self), 0))
+        return np.column_stack([self.arrays[column].astype(np.float64) for column in columns])
+
+    def event_times(self):
+        """Returns EVENT_TIME as datetime64[s] (NaT where it could not be parsed)."""
+        seconds = self.arrays[TIME_COLUMN]
+        times = seconds.astype("datetime64[s]")
+        times[seconds == MISSING_TIME] = np.datetime64("NaT")
+        return times
+
+    def to_frame(self, vocab):
+        """Rebuilds the history as a DataFrame (strings decoded, EVENT_TIME as datetime)."""
+        data = {}
+        for column in self.columns:
+            kind = self.kinds[column]
+            if kind == TIME:
+                data[column] = self.event_times()
+            elif kind == CODE:
+                data[column] = vocab.decode(column, self.arrays[column])
+            else:
+                data[column] = self.arrays[column]
+        return pd.DataFrame(data, columns=self.columns)
+
+
+def as_compact(history_data, vocab, like=None):
+    """Returns ``history_data`` as a CompactHistory, converting legacy DataFrames on the fly."""
+    if isinstance(history_data, CompactHistory):
+        return history_data
+    return CompactHistory.from_frame(history_data, vocab, like=like)
+
+
+class HistorySummary:
+    """
+    Running statistics of events evicted from a user's history.
+
+    Keeps the count, per-column mean and sum of squared deviations (merged
+    with Chan's parallel update) and the time span, so evicted events still
+    count towards the user's model without being stored.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.count = 0
+        self.mean = np.zeros(len(self.columns))
+        self.m2 = np.zeros(len(self.columns))
+        self.first_time = None
+        self.last_time = None
+
+    def add(self, history):
+        """Folds the events of a CompactHistory into the summary."""
+        matrix = history.numeric_matrix()
+        n = len(matrix)
+        if n == 0:
+            return self
+        batch_mean = matrix.mean(axis=0)
+        batch_m2 = ((matrix - batch_mean) ** 2).sum(axis=0)
+
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+        seconds = history.arrays[TIME_COLUMN]
+        seconds = seconds[seconds != MISSING_TIME]
+        if len(seconds):
+            first, last = int(seconds.min()), int(seconds.max())
+            self.first_time = first if self.first_time is None else min(self.first_time, first)
+            self.last_time = last if self.last_time is None else max(self.last_time, last)
+        return self
+
+    def covers(self, history):
+        """
+        Boolean mask of the events of ``history`` that are no newer than the last evicted event.
+
+        Eviction always takes a user's oldest events, so such events were either
+        folded into the summary already (a re-delivered export) or would be
+        evicted straight away; either way they must not be added again.
+        Events without a time are never covered.
+        """
+        seconds = history.arrays[TIME_COLUMN]
+        if self.last_time is None:
+            return np.zeros(len(seconds), dtype=bool)
+        return (seconds != MISSING_TIME) & (seconds <= self.last_time)
+
+    def lifetime_stats(self, history):
+        """Returns (mean, std) over the evicted events and the retained ``history`` together."""
+        combined = HistorySummary(self.columns)
+        combined.count, combined.mean, combined.m2 = self.count, self.mean.copy(), self.m2.copy()
+        combined.add(history)
+        std = np.sqrt(combined.m2 / max(combined.count, 1))
+        std[std == 0] = 1.0
+        return combined.mean.astype(np.float32), std.astype(np.float32)
+
+
+def retention_mask(history, max_events=None, max_age_days=None):
+    """
+    Selects the events a retention policy keeps.
+
+    Parameters:
+        history (CompactHistory): The merged history.
+        max_events (int): Keep at most this many of the most recent events.
+        max_age_days (float): Drop events older than this, measured back from the
+                              user's newest event (so re-running old files is stable).
+                              Events without a time have no age: only ``max_events``
+                              applies to them (they count as the oldest events).
+
+    Returns:
+        ndarray: Boolean mask, True for events that stay in the history.
+    """
+    keep = np.ones(len(history), dtype=bool)
+    seconds = history.arrays[TIME_COLUMN] if TIME_COLUMN in history.arrays else None
+
+    if max_age_days is not None and seconds is not None:
+        valid = seconds != MISSING_TIME
+        if valid.any():
+            cutoff = seconds[valid].max() - int(max_age_days * 86400)
+            keep &= ~valid | (seconds >= cutoff)
+
+    if max_events is not None and keep.sum() > max_events:
+        # Most recent first by EVENT_TIME (ties keep arrival order)
+        order = np.argsort(seconds, kind="stable") if seconds is not None else np.arange(len(history))
+        kept_in_order = order[keep[order]]
+        keep[:] = False
+        keep[kept_in_order[-max_events:]] = True
+
+    return keep
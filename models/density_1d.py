@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+# Density-based outliers for a single numeric column, on one sorted copy of the values
+MIN_CLUSTER_SIZE = 5  # Runs of fewer values than this are outliers (as HDBSCAN's min_cluster_size)
+MIN_SAMPLES = 2  # Neighbours behind a value's core distance (as HDBSCAN's min_samples)
+DENSITY_NEIGHBOURS = 20  # Neighbours the local spacing between values is measured over
+GAP_FACTOR = 10.0  # A gap this many local spacings wide splits two clusters
+
+
+def core_distances(sorted_values, min_samples=MIN_SAMPLES):
+    """
+    Distance from every value to its ``min_samples``-th nearest other value, for sorted input.
+
+    In one dimension the k nearest neighbours of a value are k of its
+    neighbours in sorted order, on one side or split across both, so the
+    distance is the smallest span of the k + 1 windows of consecutive
+    values that contain it: O(n * k) with no neighbour search.
+    """
+    n = len(sorted_values)
+    k = min(min_samples, n - 1)
+    core = np.full(n, np.inf)
+    if k < 1:
+        return core
+    padded = np.concatenate([np.full(k, -np.inf), sorted_values, np.full(k, np.inf)])
+    span, reach = np.empty(n), np.empty(n)  # Reused buffers: no n-sized temporaries per window
+    for left in range(k + 1):  # Neighbours taken from the left of the value
+        np.subtract(sorted_values, padded[k - left:k - left + n], out=span)
+        np.subtract(padded[2 * k - left:2 * k - left + n], sorted_values, out=reach)
+        np.maximum(span, reach, out=span)
+        np.minimum(core, span, out=core)
+    return core
+
+
+def density_outliers_1d(values, min_cluster_size=MIN_CLUSTER_SIZE, min_samples=MIN_SAMPLES, gap_factor=GAP_FACTOR,
+                        neighbours=DENSITY_NEIGHBOURS):
+    """
+    Clusters one column of values by density and flags the values outside every dense run.
+
+    The values are sorted once. The local spacing around each value is
+    estimated from the distance to its ``neighbours``-th nearest value. A gap
+    between two neighbours in sorted order splits the values when it is more
+    than ``gap_factor`` times the spacing on its denser side (or than the
+    typical gap, for runs of duplicates). So a sparse tail stays with its
+    cluster while an isolated value is cut off at the edge of dense data.
+    Runs shorter than ``min_cluster_size`` are outliers, as HDBSCAN's noise.
+    O(n log n) time for the sort and O(n) memory, with no spanning tree.
+
+    Parameters:
+        values (array-like): One numeric value per row; missing values are outliers.
+        min_cluster_size (int): Smallest run that counts as a cluster.
+        min_samples (int): Neighbours behind the core distances the scores are based on.
+        gap_factor (float): How many local spacings a gap must span to split clusters.
+        neighbours (int): Neighbourhood of the local spacing (larger is smoother).
+
+    Returns:
+        tuple: (labels, scores), row-aligned. Labels number the clusters from 0
+               in value order, -1 marks an outlier (as HDBSCAN). Scores run from
+               0 (as dense as its cluster) to 1 (isolated), in the spirit of GLOSH.
+    """
+    values = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(np.float64)
+    valid = ~np.isnan(values)
+    if valid.all():
+        rows = np.argsort(values, kind="stable")
+    else:
+        rows = np.flatnonzero(valid)
+        rows = rows[np.argsort(values[rows], kind="stable")]
+    del valid
+    if len(rows) == 0:
+        return np.full(len(values), -1, dtype=np.int64), np.full(len(values), np.nan)
+    sorted_values = values[rows]
+
+    # Local spacing; the k-th neighbour reaches about k / 2 gaps to either side
+    spacing = core_distances(sorted_values, neighbours)
+    spacing *= 2.0 / max(min(neighbours, len(sorted_values) - 1), 1)
+
+    # Floored at the typical gap so duplicated values do not split on every step
+    gaps = np.diff(sorted_values)
+    positive = gaps[gaps > 0]
+    np.maximum(spacing, np.median(positive) if len(positive) else 0.0, out=spacing)
+    del positive
+    threshold = np.minimum(spacing[:-1], spacing[1:], out=spacing[:-1])
+    threshold *= gap_factor
+    splits = gaps > threshold
+    del gaps, spacing, threshold
+
+    # Runs between splits; runs that are too short are outliers
+    run_ids = np.concatenate([[0], np.cumsum(splits)])
+    del splits
+    run_sizes = np.bincount(run_ids)
+    is_cluster = run_sizes >= min_cluster_size
+    cluster_ids = np.where(is_cluster, np.cumsum(is_cluster) - 1, -1)
+
+    # Score against the cluster's mean core distance (outliers: the mean over all clustered values)
+    core = core_distances(sorted_values, min_samples)
+    del sorted_values
+    finite = np.where(np.isfinite(core), core, 0.0)
+    clustered_sizes = np.where(is_cluster, run_sizes, 0)
+    if clustered_sizes.any():
+        run_core = np.bincount(run_ids, weights=finite)
+        reference = np.where(is_cluster, run_core / np.maximum(run_sizes, 1),
+                             run_core[is_cluster].sum() / clustered_sizes.sum())
+        ratio = np.divide(reference[run_ids], core, out=np.ones(len(core)), where=core > 0)
+        np.clip(1.0 - ratio, 0.0, 1.0, out=ratio)
+    else:
+        ratio = np.ones(len(core))
+    del core, finite
+
+    labels = np.full(len(values), -1, dtype=np.int64)
+    scores = np.full(len(values), np.nan)
+    labels[rows] = cluster_ids[run_ids]
+    scores[rows] = ratio
+    return labels, scores
@@ -2,8 +2,8 @@ import pandas as pd
 import numpy as np
 import os
 import pickle  # For storing user history
-from datetime import datetime, timedelta
 from hmmlearn import hmm
+from time_utils import normalize_event_times
 from tensorflow.keras.models import Sequential  #type: ignore
 from tensorflow.keras.layers import LSTM, Dense  # type: ignore
 import tensorflow as tf
@@ -27,16 +27,6 @@ def save_pickle(data, file_path):
     with open(file_path, "wb") as f:
         pickle.dump(data, f)
 
-def parse_event_time(event_time, timezone_offset=0):
-    """Adjust EVENT_TIME based on the user's timezone."""
-    try:
-        dt = datetime.strptime(event_time, "%d%b%Y:%H:%M:%S")
-        dt = dt + timedelta(hours=int(timezone_offset))  # Adjust for timezone
-        return dt.strftime("%d%b%Y:%H:%M:%S")  # Return adjusted time
-    except Exception as e:
-        print(f"❌ Error parsing time {event_time}: {e}")
-        return event_time  # Return original if error occurs
-
 def build_user_history(csv_path):
     """Process user data, accumulate history, and train HMM/LSTM models."""
 
@@ -55,8 +45,8 @@ def build_user_history(csv_path):
     # Preprocess data
     df['USER_NAME'] = df['USER_NAME'].astype(str)
     df['IP_ADDRESS'] = df['IP_ADDRESS'].astype(str)
+    df['EVENT_TIME'] = normalize_event_times(df['EVENT_TIME'], df['TIMEZONE'])  # Vectorized, in UTC
     df['TIMEZONE'] = pd.to_numeric(df['TIMEZONE'], errors='coerce').fillna(0).astype(int)
-    df['EVENT_TIME'] = df.apply(lambda row: parse_event_time(str(row['EVENT_TIME']), row['TIMEZONE']), axis=1)
     df['DATA_S_4'] = pd.to_numeric(df['DATA_S_4'], errors='coerce').fillna(0).astype(int)
     df['DATA_S_34'] = df['DATA_S_34'].astype(str)
 
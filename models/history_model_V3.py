@@ -2,19 +2,38 @@ import pandas as pd
 import numpy as np
 import os
 import pickle  # For storing user history
-from datetime import datetime, timedelta
-from hmmlearn import hmm
-from tensorflow.keras.models import Sequential  # type: ignore
-from tensorflow.keras.layers import LSTM, Dense  # type: ignore
-import tensorflow as tf
-
-# Disable GPU for compatibility
-tf.config.set_visible_devices([], 'GPU')
-
-# Define file paths for persistent storage
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from time_utils import normalize_event_times
+from sequence_model import train_sequence_model, load_tensorflow
+from history_store import open_history_store, HISTORY_DIR, SKIPPED_USERS_DIR
+from compact_history import (CompactHistory, HistorySummary, as_compact, retention_mask,
+                             load_vocabulary, save_vocabulary, VOCAB_FILE)
+from partition_ingest import UserPartitions
+from checkpoint import BuildJournal, atomic_write_pickle, input_fingerprint
+from username_index import load_username_index, save_username_index
+from incremental_hmm import (warm_start_hmm, is_compatible, fit_population_hmm, load_population_hmm,
+                             save_population_hmm, MAX_PRIOR_WEIGHT, POPULATION_PRIOR_WEIGHT)
+
+# Legacy single-file stores, migrated into the sharded store on first run
 HISTORY_FILE = "user_history.pkl"
 SKIPPED_USERS_FILE = "skipped_users.pkl"
-BATCH_SIZE = 5000  # Define batch size
+BATCH_SIZE = 50000  # Rows read at a time while partitioning the input by USER_ID
+N_WORKERS = os.cpu_count() or 1  # Worker processes used to train users in parallel
+PER_USER_LSTM = False  # Legacy one-LSTM-per-user mode; the shared sequence model is used instead
+TRAIN_CHUNKSIZE = 4  # Users handed to a worker at a time (small keeps the pool balanced)
+MAX_EVENTS_PER_USER = 5000  # Retention: most recent events kept per user (None = unlimited)
+MAX_HISTORY_DAYS = 365  # Retention: events older than this (vs. the user's newest event) are evicted
+INCREMENTAL_HMM = True  # Warm-start returning users on their new events instead of refitting everything
+WORKER_THREAD_ENV = {  # One math-library thread per worker process (read when the libraries load)
+    "OMP_NUM_THREADS": "1", "OPENBLAS_NUM_THREADS": "1", "MKL_NUM_THREADS": "1",
+    "TF_NUM_INTRAOP_THREADS": "1", "TF_NUM_INTEROP_THREADS": "1",
+}
+RSA_FEATURES = ['USER_ID', 'USER_NAME', 'DATA_S_1', 'IP_ADDRESS', 'IP_CITY', 'TIMEZONE',
+                'EVENT_TIME', 'DATA_S_4', 'DATA_S_34', 'RISK_SCORE', 'EVENT_TYPE']
+
+_population_hmm = None  # Cached population HMM (see get_population_hmm)
 
 def load_pickle(file_path):
     """Load data from a pickle file if it exists, else return an empty dictionary."""
@@ -24,56 +43,237 @@ def load_pickle(file_path):
     return {}
 
 def save_pickle(data, file_path):
-    """Save data to a pickle file."""
-    with open(file_path, "wb") as f:
-        pickle.dump(data, f)
+    """Save data to a pickle file (atomically, so a crash never leaves a half-written file)."""
+    atomic_write_pickle(data, file_path)
+
+def init_worker():
+    """Pin each worker process to a single TensorFlow/BLAS thread so N workers use N cores.
 
-def parse_event_time(event_time, timezone_offset=0):
-    """Adjust EVENT_TIME based on the user's timezone."""
+    The thread variables are set by ``worker_thread_env`` while the workers
+    are spawned: by the time this runs, unpickling it has already imported
+    numpy and started its BLAS pool. threadpoolctl (if installed) also caps
+    pools that are already running.
+    """
     try:
-        dt = datetime.strptime(event_time, "%d%b%Y:%H:%M:%S")
-        dt = dt + timedelta(hours=int(timezone_offset))  # Adjust for timezone
-        return dt.strftime("%d%b%Y:%H:%M:%S")  # Return adjusted time
-    except Exception as e:
-        print(f"❌ Error parsing time {event_time}: {e}")
-        return event_time  # Return original if error occurs
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=1)
+    except ImportError:
+        pass
+
+    # TensorFlow is only loaded in workers that train per-user LSTMs
+    if PER_USER_LSTM:
+        tf = load_tensorflow()
+        tf.config.threading.set_intra_op_parallelism_threads(1)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+def get_population_hmm(sequences):
+    """Returns the population HMM, fitting and saving it from ``sequences`` the first time."""
+    global _population_hmm
+    if _population_hmm is None:
+        _population_hmm = load_population_hmm()
+    if _population_hmm is None and sequences:
+        print(f"🌍 Fitting population HMM on {len(sequences)} users...")
+        _population_hmm = fit_population_hmm(sequences)
+        if _population_hmm is not None:
+            save_population_hmm(_population_hmm)
+    return _population_hmm
+
+def train_user_models(user_id, sequence, new_sequence=None, base_model=None, prior_weight=0,
+                      prev_states=None, verbose=1, train_lstm=PER_USER_LSTM):
+    """Trains the HMM (and, in legacy mode, LSTM) models for a single user's numerical sequence.
+
+    With ``base_model`` set (the user's previous HMM or the population HMM) the
+    HMM is warm-started from it and only fitted on ``new_sequence`` (or the whole
+    sequence if that is None), so the cost follows the number of new events.
+    """
+
+    # Train HMM Model
+    n_components = min(len(sequence), 3)  # Adjust the number of states
+    warm_start = INCREMENTAL_HMM and is_compatible(base_model, sequence.shape[1], n_components)
+    if warm_start and new_sequence is not None and len(new_sequence) == 0:
+        hmm_model = base_model  # No new event survived retention (fitting on 0 rows fails): keep the model
+    elif warm_start:
+        hmm_model = warm_start_hmm(base_model, prior_weight)
+        hmm_model.fit(sequence if new_sequence is None else new_sequence)
+    else:
+        from hmmlearn import hmm  # Deferred: pulls in scikit-learn
+        hmm_model = hmm.GaussianHMM(n_components=n_components, covariance_type="diag", n_iter=100)
+        hmm_model.fit(sequence)
+        new_sequence = None  # Full refit: decode the whole history again
+
+    # Fix transition matrix if needed
+    if not hasattr(hmm_model, "transmat_") or np.any(hmm_model.transmat_ == 0):
+        print(f"⚠️ Fixing transition matrix for {user_id}")
+        hmm_model.transmat_ = np.full((n_components, n_components), 1.0 / n_components)
 
-def process_batch(df, user_history, skipped_users):
-    """Processes a batch of data for user profiling and model training."""
+    # Only the new events need decoding when the old states are still valid
+    if new_sequence is not None and prev_states is not None and len(prev_states) + len(new_sequence) == len(sequence):
+        hidden_states = np.concatenate([prev_states, hmm_model.predict(new_sequence)]) if len(new_sequence) else prev_states
+    else:
+        hidden_states = hmm_model.predict(sequence)
 
+    # Sequence modelling is done once for all users by the shared model
+    if not train_lstm:
+        return {"hmm_model": hmm_model, "lstm_model": None, "hidden_states": hidden_states}
+
+    load_tensorflow()
+    from tensorflow.keras.models import Sequential  # type: ignore
+    from tensorflow.keras.layers import LSTM, Dense  # type: ignore
+
+    # Prepare data for LSTM
+    X = sequence[:-1]  # Inputs
+    y = sequence[1:]   # Outputs
+
+    X = X.reshape((X.shape[0], X.shape[1], 1))  # Reshape for LSTM
+    y = y.reshape((y.shape[0], y.shape[1]))
+
+    # Define LSTM model
+    lstm_model = Sequential([
+        LSTM(64, return_sequences=True, input_shape=(X.shape[1], 1)),
+        LSTM(32, return_sequences=False),
+        Dense(y.shape[1])
+    ])
+    lstm_model.compile(optimizer='adam', loss='mse')
+
+    # Train only if data is sufficient
+    if len(X) > 0 and len(y) > 0:
+        lstm_model.fit(X, y, epochs=15, batch_size=1, verbose=verbose)
+    else:
+        print(f"⚠️ Skipping LSTM training for {user_id} (Not enough data)")
+        lstm_model = None
+
+    return {"hmm_model": hmm_model, "lstm_model": lstm_model, "hidden_states": hidden_states}
+
+def train_user_task(task):
+    """Unpacks a training task built by ``process_batch`` (used by the worker pool)."""
+    return train_user_models(**task)
+
+@contextmanager
+def worker_thread_env():
+    """
+    Sets ``WORKER_THREAD_ENV`` while worker processes are spawned, then restores the parent's values.
+
+    A spawned worker copies the environment when it starts, before it imports
+    numpy, so the limits apply in the workers only. The parent keeps its own
+    thread settings for what it loads later (TensorFlow for the sequence
+    model, scikit-learn's OpenMP in other detectors of the same session).
+    """
+    saved = {name: os.environ.get(name) for name in WORKER_THREAD_ENV}
+    os.environ.update(WORKER_THREAD_ENV)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def create_worker_pool(n_workers):
+    """Creates the process pool used to train users in parallel (submit to it inside ``worker_thread_env``)."""
+    # Spawn (not fork) so workers never inherit an initialized TensorFlow runtime
+    ctx = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=init_worker)
+
+def drop_promoted_skipped_users(user_history, skipped_users):
+    """
+    Removes skipped-store entries of users that already have a trained history.
+
+    Users only ever move from the skipped store to the history store, and the
+    two stores are flushed one after the other, so a crash in between leaves a
+    promoted user in both. Their bucket then looks unchanged on the next run,
+    so the stale skipped entry would never be removed otherwise.
+    """
+    stale = [user_id for user_id in skipped_users.keys() if user_id in user_history]
+    for user_id in stale:
+        del skipped_users[user_id]
+    if stale:
+        skipped_users.flush()
+        print(f"🧹 Dropped {len(stale)} stale skipped-user entries left by an interrupted run.")
+    return len(stale)
+
+def prepare_events(df):
+    """Selects and types the RSA columns the history models are built from (EVENT_TIME in UTC)."""
     # Ensure required columns exist
-    features = ['USER_ID', 'USER_NAME', 'DATA_S_1', 'IP_ADDRESS', 'IP_CITY', 'TIMEZONE',
-                'EVENT_TIME', 'DATA_S_4', 'DATA_S_34', 'RISK_SCORE', 'EVENT_TYPE']
-    df = df[features]
+    df = df[RSA_FEATURES].copy()
 
     # Preprocess data
     df['USER_NAME'] = df['USER_NAME'].astype(str)
     df['IP_ADDRESS'] = df['IP_ADDRESS'].astype(str)
+    df['EVENT_TIME'] = normalize_event_times(df['EVENT_TIME'], df['TIMEZONE'])  # Vectorized, in UTC
     df['TIMEZONE'] = pd.to_numeric(df['TIMEZONE'], errors='coerce').fillna(0).astype(int)
-    df['EVENT_TIME'] = df.apply(lambda row: parse_event_time(str(row['EVENT_TIME']), row['TIMEZONE']), axis=1)
     df['DATA_S_4'] = pd.to_numeric(df['DATA_S_4'], errors='coerce').fillna(0).astype(int)
     df['DATA_S_34'] = df['DATA_S_34'].astype(str)
+    return df
+
+def process_batch(df, user_history, skipped_users, vocab, executor=None):
+    """Processes a batch of data for user profiling and model training.
 
-    # Process each user in the batch
+    Users are merged with their stored history sequentially; model training is
+    fanned out to ``executor`` (see ``create_worker_pool``) when one is given.
+    Histories are kept as ``CompactHistory`` arrays encoded against ``vocab``.
+    """
+    df = prepare_events(df)
+
+    # Merge the batch into the stored history and collect the users that need training
+    tasks = []
+    groups = []
+    unchanged = 0
     for user_id, group in df.groupby('USER_ID'):
         group = group.drop(columns=['USER_ID'])  # Remove USER_ID from the dataframe
+        task = {"user_id": user_id}
 
-        # If user exists in history, append new data
+        # Stored history (trained or skipped) that the new rows are appended to
+        entry, stored = None, None
         if user_id in user_history:
-            prev_data = user_history[user_id]["history_data"]
-            group = pd.concat([prev_data, group])  # Append new records
-
-        # Merge with skipped users if they exist
-        if user_id in skipped_users:
-            prev_data = skipped_users[user_id]["history_data"]
-            group = pd.concat([prev_data, group], ignore_index=True)
+            entry = stored = user_history[user_id]
+        elif user_id in skipped_users:
+            stored = skipped_users[user_id]
+        prev_data = as_compact(stored["history_data"], vocab) if stored is not None else None
+
+        # Re-delivered exports repeat events we already hold or have evicted; only genuinely new rows are merged
+        summary = stored.get("history_summary") if stored is not None else None
+        new_data = CompactHistory.from_frame(group, vocab, like=prev_data).drop_known(prev_data)
+        if summary is not None:
+            new_data = new_data.take(~summary.covers(new_data))
+        if prev_data is not None and len(new_data) == 0:
+            unchanged += 1
+            continue  # Nothing new: no retraining and nothing to persist
+
+        group = new_data if prev_data is None else prev_data.append(new_data)  # Append new records
+
+        # Apply the retention policy; evicted events only survive as summary statistics
+        if summary is None:
+            summary = HistorySummary(group.numeric_columns())
+        keep = retention_mask(group, MAX_EVENTS_PER_USER, MAX_HISTORY_DAYS)
+        if not keep.all():
+            summary.add(group.take(~keep))
+            group = group.take(keep)
+        n_prev = len(prev_data) if prev_data is not None else 0
+        history_hash = group.content_hash()
+
+        # The retained history is exactly what the current model was trained on (e.g. all new rows
+        # were evicted straight away): keep the model and only persist the summary, if it changed
+        if entry is not None and entry["hmm_model"] is not None and entry.get("history_hash") == history_hash:
+            if not keep.all():
+                user_history[user_id] = dict(entry, history_summary=summary)
+            unchanged += 1
+            continue
+
+        # Returning users continue from their own model, weighted by how much history it has seen
+        if entry is not None and entry["hmm_model"] is not None:
+            task["new_sequence"] = new_data.take(keep[n_prev:]).numeric_matrix()
+            task["base_model"] = entry["hmm_model"]
+            task["prior_weight"] = min(n_prev + summary.count, MAX_PRIOR_WEIGHT)
+            if len(entry["hidden_states"]) == n_prev:
+                task["prev_states"] = np.asarray(entry["hidden_states"])[keep[:n_prev]]
 
         # Convert to numerical sequences
-        sequence = group.select_dtypes(include=[np.number]).to_numpy()
+        sequence = group.numeric_matrix()
 
         # Skip users with fewer than 3 total records (but track them)
         if len(sequence) < 3:
-            skipped_users[user_id] = {"history_data": group}
+            skipped_users[user_id] = {"history_data": group, "history_summary": summary}
             print(f"⚠️ Skipping {user_id} (Only {len(sequence)} records, waiting for more data...)")
             continue  # Skip training for now
 
@@ -82,75 +282,126 @@ def process_batch(df, user_history, skipped_users):
             del skipped_users[user_id]
             print(f"✅ {user_id} has reached 3 records and is now being processed!")
 
-        # Train HMM Model
-        n_components = min(len(sequence), 3)  # Adjust the number of states
-        hmm_model = hmm.GaussianHMM(n_components=n_components, covariance_type="diag", n_iter=100)
-        hmm_model.fit(sequence)
-
-        # Fix transition matrix if needed
-        if not hasattr(hmm_model, "transmat_") or np.any(hmm_model.transmat_ == 0):
-            print(f"⚠️ Fixing transition matrix for {user_id}")
-            hmm_model.transmat_ = np.full((n_components, n_components), 1.0 / n_components)
-
-        hidden_states = hmm_model.predict(sequence)
-
-        # Prepare data for LSTM
-        X = sequence[:-1]  # Inputs
-        y = sequence[1:]   # Outputs
-
-        X = X.reshape((X.shape[0], X.shape[1], 1))  # Reshape for LSTM
-        y = y.reshape((y.shape[0], y.shape[1]))
-
-        # Define LSTM model
-        lstm_model = Sequential([
-            LSTM(64, return_sequences=True, input_shape=(X.shape[1], 1)),
-            LSTM(32, return_sequences=False),
-            Dense(y.shape[1])
-        ])
-        lstm_model.compile(optimizer='adam', loss='mse')
-
-        # Train only if data is sufficient
-        if len(X) > 0 and len(y) > 0:
-            lstm_model.fit(X, y, epochs=15, batch_size=1, verbose=1)
-        else:
-            print(f"⚠️ Skipping LSTM training for {user_id} (Not enough data)")
-            lstm_model = None
-
-        # Save trained models and history
+        task["sequence"] = sequence
+        tasks.append(task)
+        groups.append((group, summary, history_hash, entry.get("history_version", 0) if entry else 0))
+
+    if unchanged:
+        print(f"⏭️ {unchanged} users unchanged since their last fit, skipped.")
+
+    # New users start from the population model instead of a random initialization
+    if INCREMENTAL_HMM:
+        population_hmm = get_population_hmm([task["sequence"] for task in tasks])
+        for task in tasks:
+            if "base_model" not in task and population_hmm is not None:
+                task["base_model"] = population_hmm
+                task["prior_weight"] = POPULATION_PRIOR_WEIGHT
+
+    # Train every user, either in this process or fanned out to a worker pool
+    if executor is not None and len(tasks) > 1:
+        print(f"🚀 Training {len(tasks)} users on the worker pool...")
+        # Keras output is silenced in workers so their progress bars don't interleave
+        for task in tasks:
+            task["verbose"] = 0
+        # Workers are started on demand as the chunks are submitted, which map does up front
+        with worker_thread_env():
+            results = executor.map(train_user_task, tasks, chunksize=TRAIN_CHUNKSIZE)
+        results = list(results)
+    else:
+        results = [train_user_task(task) for task in tasks]
+
+    # Save trained models and history
+    for task, (group, summary, history_hash, version), models in zip(tasks, groups, results):
+        user_id = task["user_id"]
         user_history[user_id] = {
-            "hmm_model": hmm_model,
-            "lstm_model": lstm_model,
-            "history_data": group,  # Save complete history
-            "hidden_states": hidden_states
+            "hmm_model": models["hmm_model"],
+            "lstm_model": models["lstm_model"],
+            "history_data": group,  # Save retained history
+            "history_summary": summary,  # Statistics of evicted events
+            "hidden_states": models["hidden_states"],
+            "history_hash": history_hash,  # Content the models were fitted on
+            "history_version": version + 1  # Bumped on every successful fit
         }
 
     return user_history, skipped_users  # Return updated user history
 
-def build_user_history(csv_path):
-    """Processes the CSV file in batches to avoid memory issues."""
+def build_user_history(csv_path, n_workers=N_WORKERS, resume=True):
+    """Processes the CSV file bucket by bucket to avoid memory issues.
 
-    # Load existing history and skipped users
-    user_history = load_pickle(HISTORY_FILE)
-    skipped_users = load_pickle(SKIPPED_USERS_FILE)
+    The file is first hash-partitioned by USER_ID into on-disk buckets, so each
+    user is merged and trained exactly once per file while memory stays bounded
+    by the bucket size. Set ``n_workers=1`` to train users sequentially in the
+    current process.
 
-    print(f"🚀 Processing CSV file in batches of {BATCH_SIZE} rows...")
+    Every bucket is journaled once its shards are on disk. If a run dies, calling
+    this again on the same file reuses the partitions and skips the completed
+    buckets (``resume=False`` starts over from the first bucket).
+    """
 
-    # Read CSV in batches
-    chunk_iter = pd.read_csv(csv_path, chunksize=BATCH_SIZE)
+    # Open the sharded history and skipped-user stores (only touched shards are ever read)
+    user_history = open_history_store(HISTORY_DIR, legacy_file=HISTORY_FILE)
+    skipped_users = open_history_store(SKIPPED_USERS_DIR, legacy_file=SKIPPED_USERS_FILE)
+    vocab_path = os.path.join(HISTORY_DIR, VOCAB_FILE)
+    vocab = load_vocabulary(vocab_path)
+    username_index = load_username_index(HISTORY_DIR, user_history)  # Kept in step with the store
+    drop_promoted_skipped_users(user_history, skipped_users)
 
-    for chunk_idx, chunk in enumerate(chunk_iter):
-        print(f"\n📌 Processing batch {chunk_idx + 1}...")
+    journal = BuildJournal(input_fingerprint(csv_path))
+    if not resume:
+        journal.finish()
+    elif journal.resuming:
+        print(f"♻️ Resuming interrupted build: {len(journal.completed)} buckets already done.")
 
-        # Process the current batch
-        user_history, skipped_users = process_batch(chunk, user_history, skipped_users)
+    print("🚀 Partitioning CSV file by USER_ID...")
 
-        # Save updated history and skipped users after every batch
-        save_pickle(user_history, HISTORY_FILE)
-        save_pickle(skipped_users, SKIPPED_USERS_FILE)
+    # Start the worker pool once and reuse it for every batch
+    executor = create_worker_pool(n_workers) if n_workers > 1 else None
 
-        print(f"✅ Batch {chunk_idx + 1} processed successfully.")
-
-    print("\n🚀 All batches processed successfully!")
+    try:
+        with UserPartitions(csv_path, chunksize=BATCH_SIZE, work_dir=journal.partition_dir()) as partitions:
+            print(f"📦 {len(partitions)} user buckets ready{' (reused)' if partitions.reused else ''}.")
+
+            for bucket_idx in range(len(partitions)):
+                if journal.is_done(bucket_idx):
+                    continue  # Already durable from an earlier, interrupted run
+                print(f"\n📌 Processing bucket {bucket_idx + 1}/{len(partitions)}...")
+
+                # Every user of this bucket is complete, so they are trained once
+                bucket = partitions.read(bucket_idx)
+                user_history, skipped_users = process_batch(bucket, user_history, skipped_users, vocab, executor)
+
+                # Persist only the shards of users that actually changed, then journal the bucket
+                dirty = user_history.dirty_users()
+                username_index.sync(dirty, user_history)
+                save_vocabulary(vocab, vocab_path)
+                user_history.flush()
+                skipped_users.flush()
+                if dirty:
+                    save_username_index(username_index, HISTORY_DIR)
+                journal.mark_done(bucket_idx, len(dirty))
+
+                print(f"✅ Bucket {bucket_idx + 1} processed successfully.")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print("\n🚀 All buckets processed successfully!")
+    changed_users = journal.changed_users()  # Includes buckets finished before a crash
+
+    # Train the shared sequence model once over every trained user (if any of them changed)
+    if not PER_USER_LSTM and changed_users == 0:
+        print("⏭️ No user histories changed, shared sequence model left as is.")
+    elif not PER_USER_LSTM:
+        sequences, stats = [], []
+        for entry in user_history.values():
+            history = as_compact(entry["history_data"], vocab)
+            summary = entry.get("history_summary") or HistorySummary(history.numeric_columns())
+            sequences.append(history.numeric_matrix())
+            stats.append(summary.lifetime_stats(history))  # Evicted events still set the user's scale
+        train_sequence_model(sequences, stats=stats)
+
+    # The whole file is done: drop the journal and the kept partitions
+    journal.finish()
 
     # Print skipped users
     print("\n📌 Skipped Users:")
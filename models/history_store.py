@@ -0,0 +1,196 @@
+import os
+import pickle
+import zlib
+from collections import OrderedDict
+from checkpoint import atomic_write_pickle
+
+# Default on-disk layout for the persistent user history
+HISTORY_DIR = "user_history"
+SKIPPED_USERS_DIR = "skipped_users"
+N_SHARDS = 256  # Users are spread over this many shard files by hash of USER_ID
+MAX_CACHED_SHARDS = 64  # Clean shards kept in memory before the least recently used are dropped
+INDEX_FILE = "index.pkl"
+
+
+def shard_for(user_id, n_shards=N_SHARDS):
+    """Returns the shard number a USER_ID is stored in (stable across runs and machines)."""
+    return zlib.crc32(str(user_id).encode("utf-8")) % n_shards
+
+
+class ShardedHistoryStore:
+    """
+    Dict-like user history persisted as one pickle file per hash shard.
+
+    Only the shards holding a requested user are read, and ``flush`` only
+    rewrites the shards whose users were added, changed or removed. The
+    index file lists every stored USER_ID so ``keys()`` never touches a shard.
+
+    Parameters:
+        root (str): Directory holding the shard files and the index.
+        n_shards (int): Number of shards (fixed when the store is first created).
+        max_cached_shards (int): Upper bound on clean shards kept in memory.
+    """
+
+    def __init__(self, root=HISTORY_DIR, n_shards=N_SHARDS, max_cached_shards=MAX_CACHED_SHARDS):
+        self.root = root
+        self.max_cached_shards = max_cached_shards
+        os.makedirs(root, exist_ok=True)
+
+        self._index = None  # Set of stored USER_IDs
+        self._index_dirty = False
+        self._shards = OrderedDict()  # shard number -> {user_id: entry}, in LRU order
+        self._dirty = set()  # Shards with unsaved changes
+        self._dirty_users = set()  # Users added, changed or removed since the last flush
+
+        # The shard count of an existing store always wins over the argument
+        index_path = os.path.join(root, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                meta = pickle.load(f)
+            self.n_shards = meta["n_shards"]
+            self._index = meta["users"]
+        else:
+            self.n_shards = n_shards
+
+    # ---- Shard I/O ------------------------------------------------------
+
+    def _shard_path(self, shard):
+        return os.path.join(self.root, f"shard_{shard:04d}.pkl")
+
+    def _load_shard(self, shard):
+        """Returns the users of a shard, reading it from disk only if it is not cached."""
+        if shard in self._shards:
+            self._shards.move_to_end(shard)
+            return self._shards[shard]
+
+        path = self._shard_path(shard)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                users = pickle.load(f)
+        else:
+            users = {}
+
+        self._shards[shard] = users
+        self._release_clean_shards()
+        return users
+
+    def _release_clean_shards(self):
+        """Drops least recently used shards without pending changes once the cache is full."""
+        # The most recently used shard is never dropped: the caller is about to use it
+        for shard in list(self._shards)[:-1]:
+            if len(self._shards) <= self.max_cached_shards:
+                break
+            if shard not in self._dirty:
+                del self._shards[shard]
+
+    def _write_shard(self, shard):
+        users = self._shards[shard]
+        path = self._shard_path(shard)
+        if users:
+            atomic_write_pickle(users, path)  # A crash mid-write never leaves a torn shard
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def _users(self):
+        if self._index is None:
+            self._index = set()
+        return self._index
+
+    # ---- Dict interface -------------------------------------------------
+
+    def __contains__(self, user_id):
+        return user_id in self._users()
+
+    def __getitem__(self, user_id):
+        return self._load_shard(shard_for(user_id, self.n_shards))[user_id]
+
+    def get(self, user_id, default=None):
+        """Fetches a single user's entry, loading only that user's shard."""
+        if user_id not in self:
+            return default
+        return self[user_id]
+
+    def __setitem__(self, user_id, entry):
+        shard = shard_for(user_id, self.n_shards)
+        self._load_shard(shard)[user_id] = entry
+        self._dirty.add(shard)
+        self._dirty_users.add(user_id)
+        if user_id not in self._users():
+            self._users().add(user_id)
+            self._index_dirty = True
+
+    def __delitem__(self, user_id):
+        shard = shard_for(user_id, self.n_shards)
+        del self._load_shard(shard)[user_id]
+        self._dirty.add(shard)
+        self._dirty_users.add(user_id)
+        self._users().discard(user_id)
+        self._index_dirty = True
+
+    def __len__(self):
+        return len(self._users())
+
+    def __iter__(self):
+        return iter(list(self._users()))
+
+    def keys(self):
+        """Returns every stored USER_ID without reading any shard."""
+        return list(self._users())
+
+    def items(self):
+        """Yields (user_id, entry) shard by shard so only one shard needs to be read at a time."""
+        by_shard = {}
+        for user_id in self._users():
+            by_shard.setdefault(shard_for(user_id, self.n_shards), []).append(user_id)
+        for shard, user_ids in sorted(by_shard.items()):
+            users = self._load_shard(shard)
+            for user_id in user_ids:
+                yield user_id, users[user_id]
+
+    def values(self):
+        for _, entry in self.items():
+            yield entry
+
+    # ---- Persistence ----------------------------------------------------
+
+    def dirty_users(self):
+        """Returns the USER_IDs written or deleted since the last flush."""
+        return set(self._dirty_users)
+
+    def flush(self):
+        """Writes the changed shards (and the index if users were added or removed) to disk."""
+        for shard in sorted(self._dirty):
+            self._write_shard(shard)
+        written = len(self._dirty)
+        self._dirty.clear()
+        self._dirty_users.clear()
+
+        if self._index_dirty:
+            atomic_write_pickle({"n_shards": self.n_shards, "users": self._users()},
+                                os.path.join(self.root, INDEX_FILE))
+            self._index_dirty = False
+
+        self._release_clean_shards()
+        return written
+
+
+def open_history_store(root=HISTORY_DIR, legacy_file=None):
+    """
+    Opens a sharded history store, importing a legacy single-file pickle on first use.
+
+    Parameters:
+        root (str): Store directory.
+        legacy_file (str): Optional path to an old ``user_history.pkl``-style dict.
+
+    Returns:
+        ShardedHistoryStore: The opened store.
+    """
+    store = ShardedHistoryStore(root)
+    if len(store) == 0 and legacy_file and os.path.exists(legacy_file):
+        print(f"📦 Migrating {legacy_file} into sharded store '{root}'...")
+        with open(legacy_file, "rb") as f:
+            legacy = pickle.load(f)
+        for user_id, entry in legacy.items():
+            store[user_id] = entry
+        store.flush()
+    return store
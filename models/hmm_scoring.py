@@ -0,0 +1,196 @@
+import os
+import numpy as np
+from output_writer import OutputWriter
+from history_store import ShardedHistoryStore, shard_for, HISTORY_DIR, SKIPPED_USERS_DIR
+from compact_history import CompactHistory, Vocabulary, as_compact, load_vocabulary, VOCAB_FILE
+from incremental_hmm import diag_covars, load_population_hmm
+from partition_ingest import UserPartitions
+from history_model_V3 import prepare_events, BATCH_SIZE
+
+# Scoring of new RSA events against the stored per-user HMMs
+HMM_SCORES_OUTPUT = "hmm_scored_events"  # Output directory (read back with output_writer.read_output)
+LOGLIK_COLUMN = "HMM_LOGLIK"  # log p(event | user's earlier events) under the HMM
+SURPRISE_COLUMN = "HMM_SURPRISE"  # -HMM_LOGLIK
+SCORE_COLUMN = "HMM_ANOMALY_SCORE"  # Surprise above what the model expects for that step (> 0 is unusual)
+SOURCE_COLUMN = "HMM_SOURCE"  # "user", "population" or "none" (no compatible model)
+
+
+def _logsumexp(a, axis):
+    """log(sum(exp(a))) along ``axis``, stable for -inf entries."""
+    peak = np.max(a, axis=axis, keepdims=True)
+    peak = np.where(np.isfinite(peak), peak, 0.0)
+    with np.errstate(divide="ignore"):
+        return np.log(np.exp(a - peak).sum(axis=axis)) + np.squeeze(peak, axis=axis)
+
+
+def start_distribution(model, entry=None):
+    """
+    Returns the state distribution a user's new events start from.
+
+    Users with stored hidden states continue from their last state (one
+    transmat step ahead); everyone else starts from ``startprob_``.
+    """
+    states = entry.get("hidden_states") if entry is not None else None
+    if states is not None and len(states) and model is entry.get("hmm_model"):
+        return model.transmat_[int(states[-1])]
+    return model.startprob_
+
+
+def batched_forward(models, sequences, starts):
+    """
+    Runs the HMM forward pass for many users at once.
+
+    All models must share ``n_components`` and ``n_features``. Users are
+    ordered by sequence length so at step ``t`` the users still active are a
+    prefix of the batch, and each step is a single vectorized update over them.
+
+    Parameters:
+        models (list): One diag GaussianHMM per user.
+        sequences (list): One (n_events, n_features) array per user, in time order.
+        starts (list): One initial state distribution per user.
+
+    Returns:
+        tuple: (loglik, expected) flat arrays aligned with ``np.concatenate(sequences)``,
+               the per-event log-likelihood given the user's earlier events and
+               the surprise the model expects at that step.
+    """
+    lengths = np.array([len(s) for s in sequences], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    loglik = np.empty(lengths.sum())
+    expected = np.empty(lengths.sum())
+    if len(loglik) == 0:
+        return loglik, expected
+
+    # Longest sequences first; rank maps a user's original position to its place in that order
+    order = np.argsort(-lengths, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    owner = rank[np.repeat(np.arange(len(sequences)), lengths)]
+    lengths, offsets = lengths[order], offsets[order]
+    models = [models[i] for i in order]
+
+    with np.errstate(divide="ignore"):
+        log_trans = np.log(np.stack([m.transmat_ for m in models]))  # (U, K, K)
+        log_pred = np.log(np.stack([starts[i] for i in order]))  # (U, K)
+    means = np.stack([m.means_ for m in models])  # (U, K, F)
+    var = np.stack([diag_covars(m) for m in models])  # (U, K, F)
+    log_norm = np.log(2 * np.pi * var).sum(axis=2)  # (U, K)
+    entropy = 0.5 * (log_norm + var.shape[2])  # Differential entropy of each state's Gaussian
+
+    # Emission log-probabilities for every event in one shot
+    X = np.concatenate(sequences)
+    log_b = -0.5 * (log_norm[owner] + (((X[:, None, :] - means[owner]) ** 2) / var[owner]).sum(axis=2))
+
+    for t in range(lengths[0]):
+        active = int(np.searchsorted(-lengths, -t, side="left"))  # Users with more than t events
+        rows = offsets[:active] + t
+        pred = log_pred[:active]
+        joint = pred + log_b[rows]
+        step = _logsumexp(joint, axis=1)
+        loglik[rows] = step
+        expected[rows] = (np.exp(pred) * entropy[:active]).sum(axis=1)
+
+        # Filtered state distribution, then one step through the transition matrix
+        log_alpha = joint - step[:, None]
+        log_pred[:active] = _logsumexp(log_alpha[:, :, None] + log_trans[:active], axis=1)
+
+    return loglik, expected
+
+
+def score_events(df, user_history, skipped_users=None, vocab=None, population_hmm=None):
+    """
+    Scores new RSA events against each user's stored HMM without retraining anything.
+
+    Only the users present in ``df`` are read from the store. Users without a
+    compatible model of their own (new or in ``skipped_users``) are scored
+    against the population HMM.
+
+    Parameters:
+        df (DataFrame): Raw RSA events (the columns used to build the history).
+        user_history (ShardedHistoryStore): Trained users.
+        skipped_users (ShardedHistoryStore): Users still waiting for enough data.
+        vocab (Vocabulary): Shared vocabulary (only used to read legacy histories).
+        population_hmm (GaussianHMM): Fallback model (loaded from disk if None).
+
+    Returns:
+        DataFrame: The prepared events sorted by USER_ID and EVENT_TIME, with
+                   HMM_LOGLIK, HMM_SURPRISE, HMM_ANOMALY_SCORE and HMM_SOURCE columns.
+    """
+    vocab = vocab if vocab is not None else Vocabulary()
+    population_hmm = population_hmm if population_hmm is not None else load_population_hmm()
+
+    events = prepare_events(df).sort_values(['USER_ID', 'EVENT_TIME'], kind='stable').reset_index(drop=True)
+    user_ids, starts_at, counts = np.unique(events['USER_ID'].to_numpy(), return_index=True, return_counts=True)
+
+    # Fetch the users shard by shard so each shard file is read at most once
+    entries = {}
+    for user_id in sorted(user_ids, key=lambda u: shard_for(u, user_history.n_shards)):
+        if user_id in user_history:
+            entries[user_id] = user_history[user_id]
+
+    # Encode the numeric features exactly as the stored histories are laid out
+    like = next((as_compact(e["history_data"], vocab) for e in entries.values()), None)
+    if like is None and skipped_users is not None and len(skipped_users):
+        like = as_compact(next(iter(skipped_users.values()))["history_data"], vocab)
+    matrix = CompactHistory.from_frame(events.drop(columns=['USER_ID']), Vocabulary(), like=like).numeric_matrix()
+
+    # Pick a model per user and group users by model shape so each group is one batched pass
+    loglik = np.full(len(events), np.nan)
+    expected = np.full(len(events), np.nan)
+    source = np.full(len(events), "none", dtype=object)
+    groups = {}
+    for user_id, start, count in zip(user_ids, starts_at, counts):
+        entry = entries.get(user_id)
+        model, kind = (entry["hmm_model"], "user") if entry is not None else (None, None)
+        if not _can_score(model, matrix.shape[1]):
+            model, kind, entry = population_hmm, "population", None
+        if not _can_score(model, matrix.shape[1]):
+            continue
+        group = groups.setdefault(model.n_components, ([], [], [], []))
+        group[0].append(model)
+        group[1].append(matrix[start:start + count])
+        group[2].append(start_distribution(model, entry))
+        group[3].append(np.arange(start, start + count))
+        source[start:start + count] = kind
+
+    for models, sequences, starts, rows in groups.values():
+        rows = np.concatenate(rows)
+        loglik[rows], expected[rows] = batched_forward(models, sequences, starts)
+
+    events[LOGLIK_COLUMN] = loglik
+    events[SURPRISE_COLUMN] = -loglik
+    events[SCORE_COLUMN] = -loglik - expected
+    events[SOURCE_COLUMN] = source
+    return events
+
+
+def _can_score(model, n_features):
+    """True if ``model`` is a fitted diag GaussianHMM over ``n_features`` columns."""
+    return (model is not None and hasattr(model, "means_")
+            and getattr(model, "covariance_type", None) == "diag"
+            and getattr(model, "n_features", None) == n_features)
+
+
+def score_file(csv_path, output_path=HMM_SCORES_OUTPUT):
+    """
+    Scores every event of an RSA file and writes them, with their HMM scores, to ``output_path``.
+
+    The file is partitioned by USER_ID first, so memory stays bounded and every
+    user's events are scored as one continuous sequence. Each scored partition
+    is appended to the output as it is done, split by the day of EVENT_TIME.
+    """
+    if not os.path.isdir(HISTORY_DIR):
+        raise FileNotFoundError(f"{HISTORY_DIR} (build the user history first)")
+    user_history = ShardedHistoryStore(HISTORY_DIR)
+    skipped_users = ShardedHistoryStore(SKIPPED_USERS_DIR) if os.path.isdir(SKIPPED_USERS_DIR) else {}
+    vocab = load_vocabulary(os.path.join(HISTORY_DIR, VOCAB_FILE))
+    population_hmm = load_population_hmm()
+
+    print(f"🚀 Scoring {csv_path} against {len(user_history)} stored user models...")
+    with OutputWriter(output_path, partition_by="EVENT_TIME") as writer:
+        with UserPartitions(csv_path, chunksize=BATCH_SIZE) as partitions:
+            for bucket in partitions:
+                writer.write(score_events(bucket, user_history, skipped_users, vocab, population_hmm))
+
+    print(f"✅ Scored {writer.rows} events. Results saved in {output_path}/")
+    return output_path
@@ -0,0 +1,104 @@
+import os
+import pickle
+import numpy as np
+from checkpoint import atomic_write_pickle
+
+# Population-level HMM used as the starting point for users without a model of their own
+POPULATION_HMM_FILE = "population_hmm.pkl"
+N_STATES = 3
+FULL_FIT_ITER = 100  # EM iterations for a fit from scratch
+WARM_START_ITER = 10  # EM iterations when continuing from existing parameters
+WARM_START_TOL = 1e-3  # Log-likelihood gain below which warm-start EM stops early
+MAX_PRIOR_WEIGHT = 500  # Cap on how many past events the previous parameters count for
+POPULATION_PRIOR_WEIGHT = 10  # Pseudo-events the population model counts for on a new user
+POPULATION_SAMPLE_USERS = 2000  # Users pooled to fit the population model
+
+
+def diag_covars(model):
+    """Returns the (n_components, n_features) diagonal covariances of a diag GaussianHMM."""
+    return np.diagonal(model.covars_, axis1=1, axis2=2).copy()
+
+
+def is_compatible(model, n_features, n_components=N_STATES):
+    """True if ``model`` can warm-start a fit on data with ``n_features`` columns."""
+    return (model is not None
+            and getattr(model, "n_features", None) == n_features
+            and model.n_components == n_components
+            and model.covariance_type == "diag")
+
+
+def warm_start_hmm(base_model, prior_weight, n_iter=WARM_START_ITER, tol=WARM_START_TOL):
+    """
+    Builds a GaussianHMM that starts from ``base_model`` and is pulled towards it.
+
+    The base parameters are both the EM initialization and a MAP prior worth
+    ``prior_weight`` observations, so fitting on only the new events updates
+    the model instead of forgetting everything that came before.
+
+    Parameters:
+        base_model (GaussianHMM): The user's previous model or the population model.
+        prior_weight (float): How many observations the base parameters count for.
+        n_iter (int): Maximum EM iterations.
+        tol (float): Convergence tolerance on the log-likelihood gain.
+
+    Returns:
+        GaussianHMM: An unfitted model ready for ``fit(new_observations)``.
+    """
+    from hmmlearn import hmm  # Deferred: pulls in scikit-learn
+
+    n_components = base_model.n_components
+    weight = max(float(prior_weight), 1.0) / n_components  # Spread the pseudo-counts over the states
+    covars = diag_covars(base_model)
+
+    model = hmm.GaussianHMM(
+        n_components=n_components, covariance_type="diag",
+        n_iter=n_iter, tol=tol, init_params="",
+        startprob_prior=1.0 + weight * base_model.startprob_,
+        transmat_prior=1.0 + weight * base_model.transmat_,
+        means_prior=base_model.means_, means_weight=weight,
+        covars_prior=covars * weight, covars_weight=weight + 1.0,
+    )
+    model.startprob_ = base_model.startprob_.copy()
+    model.transmat_ = base_model.transmat_.copy()
+    model.means_ = base_model.means_.copy()
+    model.covars_ = covars
+    return model
+
+
+def fit_population_hmm(sequences, n_components=N_STATES, max_users=POPULATION_SAMPLE_USERS):
+    """
+    Fits one HMM over many users' sequences (each kept as its own sequence).
+
+    Parameters:
+        sequences (list): One (n_events, n_features) numeric array per user.
+        n_components (int): Number of hidden states.
+        max_users (int): Sequences pooled at most (sampled evenly).
+
+    Returns:
+        GaussianHMM or None: The fitted model, or None if there is too little data.
+    """
+    from hmmlearn import hmm  # Deferred: pulls in scikit-learn
+
+    sequences = [s for s in sequences if len(s) >= n_components]
+    if not sequences:
+        return None
+    if len(sequences) > max_users:
+        step = len(sequences) / max_users
+        sequences = [sequences[int(i * step)] for i in range(max_users)]
+
+    model = hmm.GaussianHMM(n_components=n_components, covariance_type="diag", n_iter=FULL_FIT_ITER)
+    model.fit(np.concatenate(sequences), lengths=[len(s) for s in sequences])
+    return model
+
+
+def load_population_hmm(model_path=POPULATION_HMM_FILE):
+    """Load the population HMM if it exists, else return None."""
+    if os.path.exists(model_path):
+        with open(model_path, "rb") as f:
+            return pickle.load(f)
+    return None
+
+
+def save_population_hmm(model, model_path=POPULATION_HMM_FILE):
+    """Save the population HMM to a pickle file."""
+    atomic_write_pickle(model, model_path)
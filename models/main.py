@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
-import os
 import time
+START_TIME = time.perf_counter()  # Measured before anything else is imported
+
+import os
 import pyfiglet
 import traceback  # For full error trace
-from model import run_fraud_detection  # Import the function from model.py
-import pickle
-from history_model import build_user_history
+from history_store import ShardedHistoryStore, HISTORY_DIR, SKIPPED_USERS_DIR
+
+# The model modules pull in pandas, scikit-learn, hmmlearn and TensorFlow, so they
+# are only imported once the user picks an option that needs them
+STARTUP_BUDGET_SECONDS = 1.0  # Time allowed from launch until the menu is usable
 
 # Function to display welcome message
 def display_welcome():
@@ -16,16 +20,20 @@ def display_welcome():
 def display_menu():
     print("\nOptions:")
     print("1. Run Fraud Detection Model for numerical values")
+    print("2. Score RSA events against the stored user models")
+    print("3. Watch the AUTH file for brute-force attacks in real time")
     print("0. Exit")
 
 def show_skipped_users():
     """Load and display all skipped users along with their stored history."""
-    SKIPPED_USERS_FILE = "skipped_users.pkl"
+    from compact_history import as_compact, load_vocabulary, VOCAB_FILE
 
     try:
-        # Load skipped users
-        with open(SKIPPED_USERS_FILE, "rb") as f:
-            skipped_users = pickle.load(f)
+        # Open the skipped users store
+        if not os.path.isdir(SKIPPED_USERS_DIR):
+            raise FileNotFoundError(SKIPPED_USERS_DIR)
+        skipped_users = ShardedHistoryStore(SKIPPED_USERS_DIR)
+        vocab = load_vocabulary(os.path.join(HISTORY_DIR, VOCAB_FILE))
 
         # Check if there are any skipped users
         if not skipped_users:
@@ -33,10 +41,11 @@ def show_skipped_users():
             return
 
         print("\n📌 Skipped Users and Their Stored Data:")
-        for user_id, data in skipped_users.items():
+        for user_id, data in skipped_users.items():  # Reads one shard at a time
             record_count = len(data["history_data"])
             print(f"  - User ID: {user_id} | Total Records: {record_count}")
-            print(data["history_data"].head(), "\n")  # Show first few records
+            history = as_compact(data["history_data"], vocab).to_frame(vocab)  # Decode only for display
+            print(history.head(), "\n")  # Show first few records
 
     except FileNotFoundError:
         print("❌ Skipped users file not found!")
@@ -52,6 +61,11 @@ def main():
     os.system("clear" if os.name == "posix" else "cls")  # Clear terminal screen
     display_welcome()
 
+    startup = time.perf_counter() - START_TIME
+    if startup > STARTUP_BUDGET_SECONDS:
+        print(f"⚠️ Startup took {startup:.2f}s (budget {STARTUP_BUDGET_SECONDS:.1f}s). "
+              "Check for heavy imports at module level.")
+
     while True:
         while True:
             print("\n📌 **Note:**"
@@ -101,17 +115,20 @@ def main():
             continue
 
         display_menu()
-        choice = input("\nEnter your choice (1-0): ").strip()
+        choice = input("\nEnter your choice (1, 2, 3 or 0): ").strip()
 
         if choice == "1":
             print("\nRunning Fraud Detection Model...\n")
             time.sleep(2)
 
             try:
+                from history_model_V3 import build_user_history
+                from brute_testing import run_fraud_detection
+
                 build_user_history(RSA_PATH)  # Call the model function
-                print("\nDetection complete! Save user_history.pkl fedding into Brute force now.\n")
-                run_fraud_detection(AUTH_PATH, "/home/vaiosos/Documents/Holberton/Fraude-Detection-Project/models/user_history.pkl")  # Call the model function
-                print("\nDetection complete! Check detected_anomalies.csv for results. and processed_login_attempts.csv\n")
+                print(f"\nDetection complete! Saved {HISTORY_DIR}/ fedding into Brute force now.\n")
+                run_fraud_detection(AUTH_PATH, HISTORY_DIR)  # Call the model function
+                print("\nDetection complete! Check detected_anomalies/ for results. and processed_login_attempts/\n")
 
             except ValueError as e:
                 print("\n❌ **Data Processing Error** ❌")
@@ -135,12 +152,56 @@ def main():
                 print("🔎 **Full Traceback:**")
                 traceback.print_exc()
 
+        elif choice == "2":
+            print("\nScoring RSA events...\n")
+
+            try:
+                from hmm_scoring import score_file, HMM_SCORES_OUTPUT
+
+                score_file(RSA_PATH)
+                print(f"\nScoring complete! Check '{HMM_SCORES_OUTPUT}/' (HMM_ANOMALY_SCORE > 0 is unusual).\n")
+
+            except FileNotFoundError as e:
+                print("\n❌ **Missing File Error** ❌")
+                print(f"   → {str(e)}\n")
+                traceback.print_exc()
+
+            except Exception as e:
+                print("\n❌ **Unexpected Error Occurred!** ❌")
+                print(f"   → {str(e)}\n")
+                print("🔎 **Full Traceback:**")
+                traceback.print_exc()
+
+        elif choice == "3":
+            print("\nWatching AUTH events... Press Ctrl+C to stop.\n")
+
+            try:
+                from streaming_detector import StreamingBruteForceDetector, tail_auth_events, format_alert
+
+                detector = StreamingBruteForceDetector()
+                for alert in detector.run(tail_auth_events(AUTH_PATH)):
+                    print(f"🚨 {format_alert(alert)}")
+
+            except KeyboardInterrupt:
+                print("\n⏹️ Stopped watching.")
+
+            except FileNotFoundError as e:
+                print("\n❌ **Missing File Error** ❌")
+                print(f"   → {str(e)}\n")
+                traceback.print_exc()
+
+            except Exception as e:
+                print("\n❌ **Unexpected Error Occurred!** ❌")
+                print(f"   → {str(e)}\n")
+                print("🔎 **Full Traceback:**")
+                traceback.print_exc()
+
         elif choice == "0":
             print("\nExiting... Goodbye!")
             break
 
         else:
-            print("\nInvalid choice. Please enter 1, 2, or 0.")
+            print("\nInvalid choice. Please enter 1, 2, 3, or 0.")
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,39 @@
 import pandas as pd
 import numpy as np
-import hdbscan
 import re
-from sklearn.preprocessing import StandardScaler
 from datetime import datetime
+from reference_clusterer import cluster_with_reference
+from density_1d import density_outliers_1d
+
+DENSITY_1D = True  # DATA_S_4 is a single column: use the sorted-array density engine instead of HDBSCAN
+FIT_ONCE_HDBSCAN = True  # Score DATA_S_4 against a persisted reference HDBSCAN instead of refitting every run
+HDBSCAN_PARAMS = {"min_cluster_size": 5, "min_samples": 2}
+PROXI_ID_COLUMNS = ["USER_ID", "USER_NAME", "DATA_S_1", "DATA_S_4"]
+REPORT_COLUMNS = ["Event Type", "Count", "Timestamp", "PROXI_ID", "DATA_S_1"]
+REPORT_CHUNK_ROWS = 100000  # Rows formatted per write when saving REPORT.csv
+
+def build_proxi_ids(df, columns=PROXI_ID_COLUMNS):
+    """Joins ``columns`` with "_" into one PROXI_ID per row, column by column (missing values read "nan")."""
+    proxi_ids = df[columns[0]].astype(str).fillna("nan")
+    for column in columns[1:]:
+        proxi_ids = proxi_ids + "_" + df[column].astype(str).fillna("nan")
+    return proxi_ids
+
+def build_anomaly_report(anomalies, event_type="HDBSCAN Anomaly Detection", timestamp=None):
+    """
+    Builds the report rows for all anomalies in one allocation.
+
+    Every row shares the same event type, total count and run timestamp,
+    so those are broadcast scalars and only PROXI_ID and DATA_S_1 are copied.
+    """
+    timestamp = timestamp if timestamp is not None else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return pd.DataFrame({
+        "Event Type": event_type,
+        "Count": len(anomalies),
+        "Timestamp": timestamp,
+        "PROXI_ID": anomalies["PROXI_ID"].to_numpy(),
+        "DATA_S_1": anomalies["DATA_S_1"].to_numpy(),
+    }, index=pd.RangeIndex(len(anomalies)), columns=REPORT_COLUMNS)
 
 def run_fraud_detection():
     try:
@@ -11,10 +41,7 @@ def run_fraud_detection():
         df = pd.read_csv("../Data/generated_loginsRSA.csv")
 
         # Step 1: Create PROXI_ID for Each User
-        def create_proxi_id(row):
-            return f"{row['USER_ID']}_{row['USER_NAME']}_{row['DATA_S_1']}_{row['DATA_S_4']}"
-
-        df["PROXI_ID"] = df.apply(create_proxi_id, axis=1)
+        df["PROXI_ID"] = build_proxi_ids(df)
 
         # Step 2: Select Numerical Features for Clustering
         numerical_features = ["DATA_S_4"]  # Only cluster based on valid numeric columns
@@ -26,13 +53,26 @@ def run_fraud_detection():
             print(bad_values[["DATA_S_4"]].head())  # Show problematic rows
             raise ValueError(f"Column `DATA_S_4` contains invalid values. Example: {bad_values.iloc[0]['DATA_S_4']}")
 
-        # Step 3: Standardize Features
-        scaler = StandardScaler()
-        df_scaled = scaler.fit_transform(df[numerical_features])
+        # Step 3 & 4: Standardize Features and Apply HDBSCAN Clustering
+        if DENSITY_1D:
+            # One sort of the column instead of a spanning tree; scale-free, so no standardizing
+            df["cluster"], df["outlier_score"] = density_outliers_1d(
+                df["DATA_S_4"], HDBSCAN_PARAMS["min_cluster_size"], HDBSCAN_PARAMS["min_samples"])
+        elif FIT_ONCE_HDBSCAN:
+            # The reference model carries its own scaler; new days are scored with approximate_predict
+            clusters = cluster_with_reference("data_s_4", df, numerical_features, HDBSCAN_PARAMS)
+            df["cluster"] = clusters["HDBSCAN_CLUSTER"]
+            df["outlier_score"] = clusters["HDBSCAN_OUTLIER_SCORE"]
+        else:
+            # Heavy libraries are only loaded when they are actually used
+            import hdbscan
+            from sklearn.preprocessing import StandardScaler
 
-        # Step 4: Apply HDBSCAN Clustering
-        clusterer = hdbscan.HDBSCAN(min_cluster_size=5, min_samples=2, gen_min_span_tree=True)
-        df["cluster"] = clusterer.fit_predict(df_scaled)
+            scaler = StandardScaler()
+            df_scaled = scaler.fit_transform(df[numerical_features])
+            clusterer = hdbscan.HDBSCAN(gen_min_span_tree=True, **HDBSCAN_PARAMS)
+            df["cluster"] = clusterer.fit_predict(df_scaled)
+            df["outlier_score"] = clusterer.outlier_scores_
 
         # Identify anomalies
         df["is_anomaly"] = df["cluster"] == -1
@@ -40,22 +80,9 @@ def run_fraud_detection():
         # Step 5: Report Anomalies
         anomaly_report = df[df["is_anomaly"]]
 
-        # Initialize empty DataFrame for the report
-        report_df = pd.DataFrame(columns=["Event Type", "Count", "Timestamp", "PROXI_ID", "DATA_S_1"])
-
-        for _, row in anomaly_report.iterrows():
-            new_row = pd.DataFrame([{
-                "Event Type": "HDBSCAN Anomaly Detection",
-                "Count": len(anomaly_report),
-                "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "PROXI_ID": row["PROXI_ID"],
-                "DATA_S_1": row["DATA_S_1"]
-            }])
-
-            # ✅ Correct way to append rows in Pandas 2.x
-            report_df = pd.concat([report_df, new_row], ignore_index=True)
-
-        report_df.to_csv("REPORT.csv", index=False)
+        # All rows at once, stamped with a single run timestamp
+        report_df = build_anomaly_report(anomaly_report)
+        report_df.to_csv("REPORT.csv", index=False, chunksize=REPORT_CHUNK_ROWS)
         print("\n✅ Anomaly detection complete. Results saved in REPORT.csv")
 
     except Exception as e:
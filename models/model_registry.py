@@ -0,0 +1,175 @@
+import os
+import json
+import zlib
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+from checkpoint import atomic_write_pickle
+
+# Versioned store of fitted detector models
+MODEL_REGISTRY_DIR = "model_registry"
+MANIFEST_FILE = "manifest.json"
+MODEL_MAX_AGE_DAYS = 7  # Models older than this are retrained even if the key still matches
+KEEP_VERSIONS = 2  # Saved models kept per detector (the current one plus one to roll back to)
+TRAINING_WINDOW_FREQ = "W"  # Training windows are calendar weeks: a new week gets a new model
+N_JOBS = -1  # Cores used to fit the forests (-1 = all)
+SCORING_MEMORY_MB = 256  # Memory budget for one scoring chunk
+_MANIFEST_LOCK = threading.Lock()  # Detectors running on threads share the manifest file
+
+
+def feature_schema(df, features):
+    """The (column, dtype) pairs a model is fitted on; any change means a different model."""
+    return [[column, str(df[column].dtype)] for column in features]
+
+
+def training_window(times, freq=TRAINING_WINDOW_FREQ):
+    """Labels the training window that ``times`` belongs to (e.g. "2024-08-12/2024-08-18" for weeks)."""
+    times = pd.Series(times).dropna()
+    if times.empty:
+        return "all"
+    return str(times.min().to_period(freq))
+
+
+class ModelRegistry:
+    """
+    Fitted models stored under a key of detector name + feature schema + training window.
+
+    Every save is a new version file; ``manifest.json`` maps each key to its
+    versions (with the training time) so the newest one is found without
+    unpickling anything. A model is only returned if it was fitted on the
+    same schema and window and is younger than ``max_age_days``. Only the
+    ``keep_versions`` newest models of a detector are kept (over all its
+    schemas and windows); older ones are deleted when a new one is saved.
+
+    Example:
+        registry = ModelRegistry()
+        model = registry.get("auth_users", schema, window)
+        if model is None:
+            model = fit(...)
+            registry.put("auth_users", schema, window, model)
+    """
+
+    def __init__(self, root=MODEL_REGISTRY_DIR, max_age_days=MODEL_MAX_AGE_DAYS, keep_versions=KEEP_VERSIONS):
+        self.root = root
+        self.max_age_days = max_age_days
+        self.keep_versions = keep_versions
+        os.makedirs(root, exist_ok=True)
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    @staticmethod
+    def key(detector, schema, window):
+        digest = format(zlib.crc32(json.dumps(schema).encode("utf-8")), "08x")
+        return f"{detector}__{digest}__{str(window).replace('/', '_')}"
+
+    def get(self, detector, schema, window):
+        """Returns the newest fresh model for the key, or None if it must be (re)trained."""
+        versions = self.manifest.get(self.key(detector, schema, window))
+        if not versions:
+            return None
+        latest = versions[-1]
+        age = pd.Timestamp.now() - pd.Timestamp(latest["trained_at"])
+        if self.max_age_days is not None and age > pd.Timedelta(days=self.max_age_days):
+            return None
+        path = os.path.join(self.root, latest["file"])
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def put(self, detector, schema, window, model):
+        """Saves ``model`` as a new version of its key and returns the version number."""
+        key = self.key(detector, schema, window)
+        with _MANIFEST_LOCK:
+            # Pick up versions other registries saved since this one was opened
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    self.manifest.update(json.load(f))
+            versions = self.manifest.setdefault(key, [])
+            version = versions[-1]["version"] + 1 if versions else 1
+            file_name = f"{key}__v{version}.pkl"
+            atomic_write_pickle(model, os.path.join(self.root, file_name))
+            versions.append({"version": version, "detector": detector, "schema": schema, "window": window,
+                             "trained_at": pd.Timestamp.now().isoformat(), "file": file_name})
+            expired = self._prune(detector)
+
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f, indent=1)
+            os.replace(tmp_path, self.manifest_path)
+
+            # Files go only once the manifest no longer lists them, so a crash never leaves dangling entries
+            for entry in expired:
+                try:
+                    os.remove(os.path.join(self.root, entry["file"]))
+                except FileNotFoundError:
+                    pass
+        return version
+
+    def _prune(self, detector):
+        """Drops all but the ``keep_versions`` newest manifest entries of ``detector`` and returns the dropped ones."""
+        if self.keep_versions is None:
+            return []
+        entries = [(entry["trained_at"], key, entry) for key, versions in self.manifest.items()
+                   for entry in versions if entry["detector"] == detector]
+        entries.sort(key=lambda item: item[0])
+        expired = entries[:max(len(entries) - self.keep_versions, 0)]
+        for _, key, entry in expired:
+            self.manifest[key].remove(entry)
+            if not self.manifest[key]:
+                del self.manifest[key]
+        return [entry for _, _, entry in expired]
+
+
+def scoring_chunk_rows(model, n_features, memory_mb=SCORING_MEMORY_MB):
+    """Rows per scoring chunk so the features plus per-tree depths stay within ``memory_mb``."""
+    n_estimators = len(getattr(model, "estimators_", ())) or 100
+    bytes_per_row = 8 * (n_features + 3 * n_estimators)
+    return max(1, int(memory_mb * 1024 * 1024 // bytes_per_row))
+
+
+def chunked_decision_function(model, df, features, memory_mb=SCORING_MEMORY_MB):
+    """
+    ``model.decision_function`` over ``df[features]`` one memory-capped chunk at a time.
+
+    Only one chunk is converted to a float matrix at a time, so scoring a big
+    file never builds the full feature array or the full per-tree depth matrix.
+    """
+    rows = scoring_chunk_rows(model, len(features), memory_mb)
+    scores = np.empty(len(df))
+    for start in range(0, len(df), rows):
+        chunk = df[features].iloc[start:start + rows]
+        scores[start:start + len(chunk)] = model.decision_function(chunk)
+    return scores
+
+
+def isolation_forest_scores(detector, df, features, window="all", contamination=0.05, registry=None,
+                            n_jobs=N_JOBS, memory_mb=SCORING_MEMORY_MB):
+    """
+    Scores ``df`` with the registry's IsolationForest for ``detector``, training one if needed.
+
+    A model is (re)trained on ``df`` with ``n_jobs`` cores when none exists for
+    this schema and window or the latest one is too old.
+
+    Returns:
+        tuple: (labels, scores); label -1 marks an anomaly (as ``fit_predict``),
+               lower scores are more anomalous.
+    """
+    from sklearn.ensemble import IsolationForest  # Deferred: slow to import
+
+    registry = registry if registry is not None else ModelRegistry()
+    schema = feature_schema(df, features)
+    model = registry.get(detector, schema, window)
+    if model is None:
+        print(f"🌲 Training Isolation Forest '{detector}' for window {window} on {len(df)} rows...")
+        model = IsolationForest(contamination=contamination, random_state=42, n_jobs=n_jobs)
+        model.fit(df[features])
+        version = registry.put(detector, schema, window, model)
+        print(f"📦 Saved '{detector}' v{version} to {registry.root}/")
+
+    scores = chunked_decision_function(model, df, features, memory_mb)
+    return np.where(scores < 0, -1, 1), scores
@@ -0,0 +1,134 @@
+import os
+import glob
+import shutil
+import pandas as pd
+
+# Detector outputs: date-partitioned, compressed, written chunk by chunk
+OUTPUT_FORMAT = "parquet"  # "parquet", "feather" or "csv" (gzip); columnar formats need pyarrow
+OUTPUT_COMPRESSION = "zstd"
+WRITE_CHUNK_ROWS = 500000  # Rows per part file
+FORMAT_SUFFIX = {"parquet": ".parquet", "feather": ".feather", "csv": ".csv.gz"}
+UNKNOWN_PARTITION = "unknown"  # Partition for rows whose date could not be parsed
+
+
+def columnar_available():
+    """True if pyarrow (needed for Parquet and Feather) is installed."""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class OutputWriter:
+    """
+    Writes a detector output as a directory of compressed part files.
+
+    Each ``write`` call appends new part files, so a large output can be
+    streamed chunk by chunk without materializing it as one frame. With
+    ``partition_by`` set to a date column the parts land in ``<column>=YYYY-MM-DD``
+    sub-directories, so a reader can pick single days. Only ``columns`` are
+    written when given. Opening the writer replaces any earlier output at ``path``.
+
+    Parameters:
+        path (str): Output directory.
+        fmt (str): "parquet", "feather" or "csv"; falls back to "csv" without pyarrow.
+        columns (list): Columns to keep (all if None).
+        partition_by (str): Column to partition the output by (none if None).
+        compression (str): Codec for Parquet/Feather (CSV is always gzip).
+        chunk_rows (int): Rows per part file.
+
+    Example:
+        with OutputWriter("processed_login_attempts", partition_by="EVENT_DATE") as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(self, path, fmt=OUTPUT_FORMAT, columns=None, partition_by=None,
+                 compression=OUTPUT_COMPRESSION, chunk_rows=WRITE_CHUNK_ROWS):
+        if fmt != "csv" and not columnar_available():
+            print(f"⚠️ pyarrow is not installed, writing {path} as gzip CSV instead of {fmt}.")
+            fmt = "csv"
+        self.path = path
+        self.fmt = fmt
+        self.columns = columns
+        self.partition_by = partition_by
+        self.compression = compression
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self._parts = {}  # partition directory -> next part number
+
+    def __enter__(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def write(self, df):
+        """Appends ``df`` as one or more part files."""
+        if self.columns is not None:
+            df = df[[column for column in self.columns if column in df.columns]]
+        for start in range(0, len(df), self.chunk_rows):
+            chunk = df.iloc[start:start + self.chunk_rows]
+            if self.partition_by is None:
+                self._write_part(chunk, self.path)
+                continue
+            for key, part in chunk.groupby(self._partition_keys(chunk), sort=False):
+                self._write_part(part, os.path.join(self.path, f"{self.partition_by}={key}"))
+
+    def _partition_keys(self, chunk):
+        values = chunk[self.partition_by]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.dt.strftime("%Y-%m-%d")
+        return values.astype(object).where(values.notna(), UNKNOWN_PARTITION).astype(str).to_numpy()
+
+    def _write_part(self, part, directory):
+        os.makedirs(directory, exist_ok=True)
+        number = self._parts.get(directory, 0)
+        self._parts[directory] = number + 1
+        file_path = os.path.join(directory, f"part-{number:05d}{FORMAT_SUFFIX[self.fmt]}")
+
+        if self.fmt == "parquet":
+            part.to_parquet(file_path, index=False, compression=self.compression)
+        elif self.fmt == "feather":
+            part.reset_index(drop=True).to_feather(file_path, compression=self.compression)
+        else:
+            part.to_csv(file_path, index=False, compression="gzip")
+        self.rows += len(part)
+
+
+def write_frame(df, path, **kwargs):
+    """Writes ``df`` with an ``OutputWriter`` and returns the output directory."""
+    with OutputWriter(path, **kwargs) as writer:
+        writer.write(df)
+    return writer.path
+
+
+def output_files(path):
+    """Part files of an output directory, in a stable order."""
+    files = []
+    for suffix in FORMAT_SUFFIX.values():
+        files.extend(glob.glob(os.path.join(path, "**", f"*{suffix}"), recursive=True))
+    return sorted(files)
+
+
+def read_output(path, columns=None):
+    """
+    Loads an output written by ``OutputWriter``, reading only ``columns`` when given.
+
+    Parquet and Feather only decode the requested columns, so e.g. the
+    anomaly flags can be loaded without the rest of the enriched frame.
+    """
+    frames = []
+    for file_path in output_files(path):
+        if file_path.endswith(".parquet"):
+            frames.append(pd.read_parquet(file_path, columns=columns))
+        elif file_path.endswith(".feather"):
+            frames.append(pd.read_feather(file_path, columns=columns))
+        else:
+            frames.append(pd.read_csv(file_path, usecols=columns))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,125 @@
+import os
+import json
+import math
+import shutil
+import tempfile
+import pandas as pd
+
+# Bucketing of raw RSA files by USER_ID before training
+READ_CHUNKSIZE = 50000  # Rows read from the raw file at a time while partitioning
+TARGET_BUCKET_BYTES = 32 * 1024 * 1024  # Aim for buckets of about this size on disk
+MIN_BUCKETS = 1
+MAX_BUCKETS = 4096
+MANIFEST_FILE = "partitions.json"  # Written once a resumable partitioning has completed
+
+
+def bucket_count(csv_path, target_bytes=TARGET_BUCKET_BYTES):
+    """Picks how many buckets a file is split into so each one comfortably fits in memory."""
+    size = os.path.getsize(csv_path)
+    return max(MIN_BUCKETS, min(MAX_BUCKETS, math.ceil(size / target_bytes)))
+
+
+def bucket_ids(user_ids, n_buckets):
+    """Maps USER_IDs to bucket numbers with a stable, vectorized hash."""
+    hashes = pd.util.hash_pandas_object(pd.Series(user_ids).astype(str), index=False).to_numpy()
+    return hashes % n_buckets
+
+
+def partition_csv_by_user(csv_path, out_dir, n_buckets=None, chunksize=READ_CHUNKSIZE, key="USER_ID"):
+    """
+    Splits a CSV into on-disk buckets so that every user lands in exactly one bucket.
+
+    The input is streamed in chunks and each chunk's rows are appended to their
+    bucket file, so memory stays bounded by the chunk size and rows of a user
+    keep their original order.
+
+    Parameters:
+        csv_path (str): Raw input file.
+        out_dir (str): Directory that receives ``bucket_XXXX.csv`` files.
+        n_buckets (int): Number of buckets (derived from the file size if None).
+        chunksize (int): Rows read at a time.
+        key (str): Column the rows are partitioned by.
+
+    Returns:
+        list: Paths of the non-empty bucket files, in bucket order.
+    """
+    if n_buckets is None:
+        n_buckets = bucket_count(csv_path)
+    os.makedirs(out_dir, exist_ok=True)
+
+    written = set()
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        buckets = bucket_ids(chunk[key], n_buckets)
+        for bucket, part in chunk.groupby(buckets, sort=False):
+            path = os.path.join(out_dir, f"bucket_{bucket:04d}.csv")
+            part.to_csv(path, mode="a", header=bucket not in written, index=False)
+            written.add(bucket)
+
+    return [os.path.join(out_dir, f"bucket_{bucket:04d}.csv") for bucket in sorted(written)]
+
+
+class UserPartitions:
+    """
+    Context manager that partitions a CSV by USER_ID into a scratch directory.
+
+    Iterating yields one DataFrame per bucket; the scratch files are removed on exit.
+    With ``work_dir`` set the buckets are written there instead and kept on exit,
+    together with a manifest, so an interrupted build can reuse them rather than
+    partitioning the whole file again.
+
+    Example:
+        with UserPartitions("Agosto_13_2024.csv") as partitions:
+            for bucket in partitions:
+                ...
+    """
+
+    def __init__(self, csv_path, n_buckets=None, chunksize=READ_CHUNKSIZE, scratch_dir=None, work_dir=None):
+        self.csv_path = csv_path
+        self.n_buckets = n_buckets
+        self.chunksize = chunksize
+        self.scratch_dir = scratch_dir
+        self.work_dir = work_dir
+        self.paths = []
+        self.reused = False  # True if the buckets of an earlier, interrupted run were picked up
+        self._tmp = None
+
+    def __enter__(self):
+        if self.work_dir is None:
+            self._tmp = tempfile.mkdtemp(prefix="user_partitions_", dir=self.scratch_dir)
+            self.paths = partition_csv_by_user(self.csv_path, self._tmp, self.n_buckets, self.chunksize)
+            return self
+
+        manifest = os.path.join(self.work_dir, MANIFEST_FILE)
+        if os.path.exists(manifest):
+            with open(manifest, "r", encoding="utf-8") as f:
+                names = json.load(f)
+            self.paths = [os.path.join(self.work_dir, name) for name in names]
+            self.reused = True
+            return self
+
+        # No manifest: any buckets present are from a partitioning that was cut short
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        self.paths = partition_csv_by_user(self.csv_path, self.work_dir, self.n_buckets, self.chunksize)
+        tmp_manifest = manifest + ".tmp"
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump([os.path.basename(path) for path in self.paths], f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_manifest, manifest)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._tmp is not None:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+        return False
+
+    def __len__(self):
+        return len(self.paths)
+
+    def read(self, idx):
+        """Loads a single bucket as a DataFrame."""
+        return pd.read_csv(self.paths[idx])
+
+    def __iter__(self):
+        for idx in range(len(self.paths)):
+            yield self.read(idx)
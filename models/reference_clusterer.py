@@ -0,0 +1,128 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from checkpoint import atomic_write_pickle
+
+# HDBSCAN fitted once on a reference window and reused to score later days
+CLUSTER_MODEL_DIR = "cluster_models"
+REFIT_DAYS = 7  # A reference clusterer older than this is refitted on the current data
+REFERENCE_MAX_ROWS = 200000  # Rows sampled from the current data when (re)fitting
+PREDICT_BATCH_ROWS = 50000  # Rows scored per approximate_predict call
+
+
+class ReferenceClusterer:
+    """
+    A persisted scaler + HDBSCAN pair that scores new data without refitting.
+
+    The clusterer is fitted with ``prediction_data=True`` so new points are
+    placed into the reference clusters with ``approximate_predict``, which is
+    linear in the number of new points. Labels stay comparable across days
+    because every day is scored against the same clusters.
+
+    Parameters:
+        features (list): Columns the model is fitted on, in order.
+        params (dict): Keyword arguments for ``hdbscan.HDBSCAN``.
+    """
+
+    def __init__(self, features, params):
+        self.features = list(features)
+        self.params = dict(params)
+        self.scaler = None
+        self.clusterer = None
+        self.fitted_at = None
+        self.n_reference = 0
+
+    def fit(self, df, max_rows=REFERENCE_MAX_ROWS, random_state=42):
+        """Fits the scaler and clusterer on ``df`` (sampled down to ``max_rows``)."""
+        import hdbscan
+        from sklearn.preprocessing import StandardScaler
+
+        reference = df[self.features]
+        if len(reference) > max_rows:
+            reference = reference.sample(max_rows, random_state=random_state)
+        self.scaler = StandardScaler().fit(reference)
+        self.clusterer = hdbscan.HDBSCAN(prediction_data=True, **self.params)
+        self.clusterer.fit(self.scaler.transform(reference))
+        self.fitted_at = pd.Timestamp.now()
+        self.n_reference = len(reference)
+        return self
+
+    def is_stale(self, features, params, refit_days=REFIT_DAYS):
+        """True if the model was fitted on other features/parameters or is due for its scheduled refit."""
+        if self.clusterer is None or list(features) != self.features or dict(params) != self.params:
+            return True
+        return refit_days is not None and pd.Timestamp.now() - self.fitted_at > pd.Timedelta(days=refit_days)
+
+    def predict(self, df, batch_rows=PREDICT_BATCH_ROWS):
+        """
+        Assigns rows of ``df`` to the reference clusters in batches.
+
+        Returns:
+            tuple: (labels, strengths, outlier_scores) arrays; label -1 marks an outlier.
+        """
+        from hdbscan import prediction
+
+        n = len(df)
+        labels = np.empty(n, dtype=np.int64)
+        strengths = np.empty(n)
+        scores = np.empty(n)
+        for start in range(0, n, batch_rows):
+            points = self.scaler.transform(df[self.features].iloc[start:start + batch_rows])
+            batch_labels, batch_strengths = prediction.approximate_predict(self.clusterer, points)
+            labels[start:start + len(points)] = batch_labels
+            strengths[start:start + len(points)] = batch_strengths
+            if hasattr(prediction, "approximate_predict_scores"):
+                scores[start:start + len(points)] = prediction.approximate_predict_scores(self.clusterer, points)
+            else:
+                scores[start:start + len(points)] = 1.0 - batch_strengths
+        return labels, strengths, scores
+
+
+def _model_path(name, model_dir):
+    return os.path.join(model_dir, f"{name}_hdbscan.pkl")
+
+
+def load_reference_clusterer(name, model_dir=CLUSTER_MODEL_DIR):
+    """Loads a saved reference clusterer, or returns None if there is none."""
+    path = _model_path(name, model_dir)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    return None
+
+
+def save_reference_clusterer(model, name, model_dir=CLUSTER_MODEL_DIR):
+    os.makedirs(model_dir, exist_ok=True)
+    atomic_write_pickle(model, _model_path(name, model_dir))
+
+
+def cluster_with_reference(name, df, features, params, refit_days=REFIT_DAYS, model_dir=CLUSTER_MODEL_DIR):
+    """
+    Clusters ``df`` against the persisted reference model ``name``, refitting it when needed.
+
+    A missing, stale or mismatched model is refitted on ``df`` first (with
+    ``refit_days=0`` every call refits). Either way every row is then scored
+    with ``approximate_predict``, so a refit day and a scoring day produce
+    labels in the same way.
+
+    Parameters:
+        name (str): Model name (one file per detector).
+        df (DataFrame): Rows to cluster.
+        features (list): Feature columns.
+        params (dict): ``hdbscan.HDBSCAN`` keyword arguments.
+
+    Returns:
+        DataFrame: ``HDBSCAN_CLUSTER``, ``HDBSCAN_STRENGTH`` and ``HDBSCAN_OUTLIER_SCORE``, aligned with ``df``.
+    """
+    model = load_reference_clusterer(name, model_dir)
+    if model is None or model.is_stale(features, params, refit_days):
+        print(f"🔄 Fitting reference HDBSCAN '{name}' on {len(df)} rows...")
+        model = ReferenceClusterer(features, params).fit(df)
+        save_reference_clusterer(model, name, model_dir)
+    else:
+        print(f"📦 Scoring against reference HDBSCAN '{name}' (fitted {model.fitted_at:%Y-%m-%d}).")
+
+    labels, strengths, scores = model.predict(df)
+    return pd.DataFrame({"HDBSCAN_CLUSTER": labels, "HDBSCAN_STRENGTH": strengths,
+                         "HDBSCAN_OUTLIER_SCORE": scores}, index=df.index)
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+# Exact sliding-window counts over sorted event arrays
+ROLLING_WINDOWS = (1, 60, 600)  # Seconds: a burst, 1 min, 10 min
+
+
+def _nanos(seconds):
+    return int(round(seconds * 1e9))
+
+
+class SortedEvents:
+    """
+    Events sorted once by (key, time), with per-row window bounds found by binary search.
+
+    Every row's window covers the events of the same key with a time in
+    ``(t - window, t]`` (events at the very same time all count). Keys are
+    factorized and times dense-ranked, so (key, time) becomes one sorted int64
+    array and the bounds of all rows and windows are a few ``searchsorted``
+    calls: O(n log n) overall, with no per-key loops and no time buckets.
+
+    Parameters:
+        keys (array-like): Grouping key per row (e.g. USER_ID or IP_ADDRESS).
+        times (array-like): datetime64 per row; rows without a time are left out (NaN results).
+    """
+
+    def __init__(self, keys, times):
+        times = pd.Series(pd.to_datetime(times)).to_numpy("datetime64[ns]")
+        key_codes = pd.factorize(pd.Series(keys).to_numpy())[0]
+        self.n = len(times)
+        self.valid = (key_codes >= 0) & ~np.isnat(times)
+
+        self.rows = np.flatnonzero(self.valid)
+        key_codes = key_codes[self.rows].astype(np.int64)
+        nanos = times[self.rows].astype(np.int64)
+        self.unique_nanos, time_rank = np.unique(nanos, return_inverse=True)
+        self._stride = len(self.unique_nanos) + 1
+
+        composite = key_codes * self._stride + time_rank.reshape(-1)
+        order = np.argsort(composite, kind="stable")
+        self.rows = self.rows[order]
+        self.keys = key_codes[order]
+        self.ranks = time_rank.reshape(-1)[order]
+        self.composite = composite[order]
+        self.ends = np.searchsorted(self.composite, self.composite, side="right")  # Past the row's time (ties included)
+
+    def position(self, ranks):
+        """Sorted position of the first event of each row's key at or after the time of rank ``ranks``."""
+        return np.searchsorted(self.composite, self.keys * self._stride + ranks, side="left")
+
+    def shifted_ranks(self, offset):
+        """
+        Per row, the rank of the first known time at or after the row's time + ``offset`` nanoseconds.
+
+        Searched once per distinct time (sorted, so cache friendly) and then
+        gathered per row, rather than one random binary search per row.
+        """
+        shifted = np.searchsorted(self.unique_nanos, self.unique_nanos + offset, side="left")
+        return shifted[self.ranks]
+
+    def starts(self, window):
+        """Sorted position of the first event inside each row's window of ``window`` seconds."""
+        return self.position(self.shifted_ranks(1 - _nanos(window)))
+
+    def to_rows(self, sorted_values):
+        """Scatters per-sorted-position values back to the original row order (NaN for left-out rows)."""
+        result = np.full(self.n, np.nan)
+        result[self.rows] = sorted_values
+        return result
+
+
+def window_counts(keys, times, windows=ROLLING_WINDOWS, weights=None, events=None):
+    """
+    Events (or the sum of ``weights``, e.g. a failure mask) per key in the last w seconds, per row.
+
+    Returns:
+        DataFrame: One column per window (``window`` seconds as the name), row-aligned.
+    """
+    events = events if events is not None else SortedEvents(keys, times)
+    if weights is None:
+        totals = np.arange(len(events.rows) + 1)
+    else:
+        totals = np.concatenate([[0], np.cumsum(np.asarray(weights, dtype=np.int64)[events.rows])])
+
+    result = {}
+    for window in windows:
+        result[window] = events.to_rows(totals[events.ends] - totals[events.starts(window)])
+    return pd.DataFrame(result, index=pd.Series(times).index)
+
+
+def window_distinct_counts(keys, times, values, windows=ROLLING_WINDOWS, events=None):
+    """
+    Exact distinct ``values`` per key in the last w seconds, per row.
+
+    Each event of a (key, value) pair keeps the value in the window of the
+    rows from its own time until the pair's next event or until it drops out
+    of the window, whichever comes first. Those are contiguous runs of sorted
+    positions, so the count per row is a running sum of +1/-1 markers.
+
+    Returns:
+        DataFrame: One column per window (``window`` seconds as the name), row-aligned.
+    """
+    events = events if events is not None else SortedEvents(keys, times)
+    value_codes = pd.factorize(pd.Series(values).to_numpy())[0][events.rows]
+
+    # Time rank of the same (key, value) pair's next event (past every time if there is none)
+    pairs = np.lexsort((events.ranks, value_codes, events.keys))
+    next_ranks = np.full(len(pairs), len(events.unique_nanos))
+    same_pair = (events.keys[pairs][1:] == events.keys[pairs][:-1]) & (value_codes[pairs][1:] == value_codes[pairs][:-1])
+    next_ranks[pairs[:-1][same_pair]] = events.ranks[pairs][1:][same_pair]
+    counted = value_codes >= 0  # Missing values are not counted
+
+    size = len(events.rows) + 1
+    first = np.bincount(events.position(events.ranks)[counted], minlength=size)
+    result = {}
+    for window in windows:
+        last = events.position(np.minimum(next_ranks, events.shifted_ranks(_nanos(window))))
+        markers = first - np.bincount(last[counted], minlength=size)
+        result[window] = events.to_rows(np.cumsum(markers)[:-1])
+    return pd.DataFrame(result, index=pd.Series(times).index)
+
+
+def rolling_window_features(df, windows=ROLLING_WINDOWS, time_col="EVENT_TIME_UTC", user_col="USER_ID",
+                            ip_col="IP_ADDRESS", failed=None):
+    """
+    Adds sliding-window features for every window in ``windows`` (seconds):
+    ``ATTEMPTS_PER_USER_<w>S``, ``USERS_PER_IP_<w>S`` and, when a ``failed``
+    mask is given, ``FAILURES_PER_IP_<w>S``. The IP features share one sort.
+    """
+    attempts = window_counts(df[user_col], df[time_col], windows)
+    ip_events = SortedEvents(df[ip_col], df[time_col])
+    users = window_distinct_counts(df[ip_col], df[time_col], df[user_col], windows, events=ip_events)
+    for window in windows:
+        df[f"ATTEMPTS_PER_USER_{window}S"] = attempts[window].to_numpy()
+        df[f"USERS_PER_IP_{window}S"] = users[window].to_numpy()
+
+    if failed is not None:
+        failures = window_counts(df[ip_col], df[time_col], windows, weights=failed, events=ip_events)
+        for window in windows:
+            df[f"FAILURES_PER_IP_{window}S"] = failures[window].to_numpy()
+    return df
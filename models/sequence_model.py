@@ -0,0 +1,180 @@
+import os
+import numpy as np
+
+# One population-level model replaces the per-user LSTMs
+SEQUENCE_MODEL_FILE = "sequence_model.keras"
+SEQUENCE_LENGTH = 32  # Events per training window
+SEQUENCE_EPOCHS = 15
+SEQUENCE_BATCH_SIZE = 256  # Windows per gradient step
+SCORING_BATCH_SIZE = 4096  # Windows per forward pass when scoring
+PAD_VALUE = 0.0  # Fills the unused tail of a window; those steps get zero weight in the loss
+
+
+def load_tensorflow():
+    """Imports TensorFlow on first use (it takes seconds) and keeps it on the CPU."""
+    import tensorflow as tf
+    try:
+        tf.config.set_visible_devices([], 'GPU')  # Disable GPU for compatibility
+    except RuntimeError:
+        pass  # Devices were already initialized by an earlier caller
+    return tf
+
+
+def normalization_stats(sequence):
+    """Returns the per-user (mean, std) used to put every user on the same scale."""
+    sequence = np.asarray(sequence, dtype=np.float32)
+    mean = sequence.mean(axis=0)
+    std = sequence.std(axis=0)
+    std[std == 0] = 1.0  # Constant features stay at zero after centering
+    return mean, std
+
+
+def normalize_sequence(sequence, stats=None):
+    """Centers and scales a user's sequence with their own statistics."""
+    sequence = np.asarray(sequence, dtype=np.float32)
+    mean, std = stats if stats is not None else normalization_stats(sequence)
+    return (sequence - mean) / std
+
+
+def make_windows(sequences, stats=None, window=SEQUENCE_LENGTH):
+    """
+    Cuts normalized user sequences into padded next-event prediction windows.
+
+    Parameters:
+        sequences (list): One (n_events, n_features) array per user.
+        stats (list): Optional (mean, std) per user, computed from the sequence if omitted.
+        window (int): Number of time steps per window.
+
+    Returns:
+        tuple: (X, y, owner, length) where X/y are (n_windows, window, n_features)
+               float32 arrays, owner maps each window back to its user and
+               length is the number of real (unpadded) steps in the window.
+               Padding is only ever at the end of a window (see ``step_weights``).
+    """
+    n_features = next((np.asarray(s).shape[1] for s in sequences if len(s) > 1), 0)
+    starts = []
+    for user_idx, sequence in enumerate(sequences):
+        # Each window predicts events[t + 1] from events[t], so a user with n events has n - 1 targets
+        n_targets = len(sequence) - 1
+        for start in range(0, max(n_targets, 0), window):
+            starts.append((user_idx, start, min(window, n_targets - start)))
+
+    X = np.full((len(starts), window, n_features), PAD_VALUE, dtype=np.float32)
+    y = np.zeros((len(starts), window, n_features), dtype=np.float32)
+    owner = np.empty(len(starts), dtype=np.int64)
+    length = np.empty(len(starts), dtype=np.int64)
+
+    normalized = [normalize_sequence(s, stats[i] if stats is not None else None) if len(s) > 1 else None
+                  for i, s in enumerate(sequences)]
+    for row, (user_idx, start, n_steps) in enumerate(starts):
+        sequence = normalized[user_idx]
+        X[row, :n_steps] = sequence[start:start + n_steps]
+        y[row, :n_steps] = sequence[start + 1:start + 1 + n_steps]
+        owner[row] = user_idx
+        length[row] = n_steps
+
+    return X, y, owner, length
+
+
+def step_weights(length, window=SEQUENCE_LENGTH):
+    """
+    Per-step loss weights: 1 for the real steps of each window, 0 for its padding.
+
+    Padding is told apart by position, not by value: a centered event equal
+    to the user's mean is all zeros too (and for users with constant
+    features every event is), so a value mask would drop real data.
+    """
+    return (np.arange(window)[None, :] < np.asarray(length)[:, None]).astype(np.float32)
+
+
+def build_sequence_model(n_features, window=SEQUENCE_LENGTH):
+    """
+    Defines the shared LSTM that predicts every user's next event.
+
+    The LSTMs only look backwards and padding only trails a window, so real
+    steps never see the padding; it is kept out of the loss with ``step_weights``.
+    """
+    load_tensorflow()
+    from tensorflow.keras.models import Sequential  # type: ignore
+    from tensorflow.keras.layers import LSTM, Dense, TimeDistributed, Input  # type: ignore
+
+    model = Sequential([
+        Input(shape=(window, n_features)),
+        LSTM(64, return_sequences=True),
+        LSTM(32, return_sequences=True),
+        TimeDistributed(Dense(n_features))
+    ])
+    model.compile(optimizer='adam', loss='mse')
+    return model
+
+
+def load_sequence_model(model_path=SEQUENCE_MODEL_FILE):
+    """Load the shared sequence model if it exists, else return None."""
+    if os.path.exists(model_path):
+        load_tensorflow()
+        from tensorflow.keras.models import load_model  # type: ignore
+        return load_model(model_path)
+    return None
+
+
+def train_sequence_model(sequences, stats=None, model_path=SEQUENCE_MODEL_FILE, epochs=SEQUENCE_EPOCHS, verbose=1):
+    """
+    Trains (or keeps training) the shared sequence model over all users at once.
+
+    Parameters:
+        sequences (list): One (n_events, n_features) numeric array per user.
+        stats (list): Optional per-user (mean, std); computed from each sequence if omitted.
+        model_path (str): Where the single model artifact is stored.
+        epochs (int): Passes over the padded windows.
+
+    Returns:
+        Model or None: The trained model, or None if there was nothing to train on.
+    """
+    X, y, _, length = make_windows(sequences, stats)
+    if len(X) == 0:
+        print("⚠️ Skipping sequence model training (Not enough data)")
+        return None
+
+    # Continue from the previous run's weights when the feature layout still matches
+    model = load_sequence_model(model_path)
+    if model is None or model.input_shape[1:] != X.shape[1:]:
+        model = build_sequence_model(X.shape[2], X.shape[1])
+
+    print(f"🚀 Training shared sequence model on {len(sequences)} users ({len(X)} windows)...")
+    model.fit(X, y, sample_weight=step_weights(length, X.shape[1]), epochs=epochs,
+              batch_size=SEQUENCE_BATCH_SIZE, shuffle=True, verbose=verbose)
+    tmp_path = model_path + ".tmp.keras"  # Saved aside and swapped in, so a crash keeps the old model
+    model.save(tmp_path)
+    os.replace(tmp_path, model_path)
+    return model
+
+
+def score_sequences(model, sequences, stats=None):
+    """
+    Computes next-event prediction error for many users in a single batched pass.
+
+    Parameters:
+        model (Model): The shared sequence model.
+        sequences (list): One (n_events, n_features) numeric array per user.
+        stats (list): Optional per-user (mean, std), e.g. taken from the stored history,
+                      so new events are scored on the user's historical scale.
+
+    Returns:
+        list: One array per user with the squared error of every predicted event
+              (length n_events - 1; empty for users with a single event).
+    """
+    X, y, owner, length = make_windows(sequences, stats, window=model.input_shape[1])
+    errors = [np.empty(0, dtype=np.float32) for _ in sequences]
+    if len(X) == 0:
+        return errors
+
+    predictions = model.predict(X, batch_size=SCORING_BATCH_SIZE, verbose=0)
+    step_error = ((predictions - y) ** 2).mean(axis=2)
+
+    # Stitch each user's windows back together in order
+    pieces = {}
+    for row, user_idx in enumerate(owner):
+        pieces.setdefault(user_idx, []).append(step_error[row, :length[row]])
+    for user_idx, parts in pieces.items():
+        errors[user_idx] = np.concatenate(parts)
+    return errors
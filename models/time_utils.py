@@ -0,0 +1,207 @@
+import numpy as np
+import pandas as pd
+
+# Timestamp layouts found in the bank exports
+RSA_TIME_FORMAT = "%d%b%Y:%H:%M:%S"  # e.g. 13AUG2024:08:15:00 (RSA EVENT_TIME, REPORT_DATE)
+AUTH_TIME_FORMAT = "%d%m%y%H:%M:%S"  # e.g. 13082408:15:00 (AUTH EVENT_DATE)
+EVENT_TIME_FORMATS = (RSA_TIME_FORMAT, AUTH_TIME_FORMAT)
+
+# Fixed-width layouts decoded straight from the character codes: field -> (start, end)
+FIXED_WIDTH_LAYOUTS = {
+    RSA_TIME_FORMAT: (18, {"day": (0, 2), "month_name": (2, 5), "year": (5, 9),
+                           "hour": (10, 12), "minute": (13, 15), "second": (16, 18)}, (9, 12, 15)),
+    AUTH_TIME_FORMAT: (14, {"day": (0, 2), "month": (2, 4), "year2": (4, 6),
+                            "hour": (6, 8), "minute": (9, 11), "second": (12, 14)}, (8, 11)),
+}
+MONTH_NAMES = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+
+
+def _month_keys(letters):
+    """Packs three upper-cased letters per row into one integer for lookup."""
+    return (letters[:, 0] << 16) | (letters[:, 1] << 8) | letters[:, 2]
+
+
+_MONTH_KEYS = _month_keys(np.array([[ord(c) for c in name] for name in MONTH_NAMES], dtype=np.int64))
+_MONTH_ORDER = np.argsort(_MONTH_KEYS)
+
+
+def _char_codes(text, width):
+    """Returns an (n_rows, width) int32 matrix of character codes (0 past the end of a string)."""
+    chars = text.to_numpy(dtype=object).astype(f"U{width}")
+    return chars.view(np.uint32).reshape(len(chars), width).astype(np.int32)
+
+
+def _parse_fixed_width(codes, fmt):
+    """
+    Decodes timestamps of a known fixed-width layout with pure array arithmetic.
+
+    ``codes`` comes from ``_char_codes`` and must be at least one column wider
+    than the layout. Returns datetime64[ns] values and a mask of the rows that
+    did not match the layout (those are left to ``pd.to_datetime``).
+    """
+    width, fields, colons = FIXED_WIDTH_LAYOUTS[fmt]
+    times = np.full(len(codes), np.datetime64("NaT"), dtype="datetime64[ns]")
+
+    # Cheap shape check first (length and separators) so other layouts are rejected early
+    shaped = (codes[:, width] == 0) & (codes[:, width - 1] != 0)
+    for pos in colons:
+        shaped &= codes[:, pos] == ord(":")
+    rows = np.flatnonzero(shaped)
+    codes = codes[rows]
+    ok = np.ones(len(rows), dtype=bool)
+
+    def number(start, end):
+        digits = codes[:, start:end] - ord("0")
+        valid = (digits.astype(np.uint32) <= 9).all(axis=1)  # Negative values wrap around and fail too
+        return digits @ (10 ** np.arange(end - start - 1, -1, -1, dtype=np.int32)), valid
+
+    values = {}
+    for field, (start, end) in fields.items():
+        if field == "month_name":
+            keys = _month_keys(codes[:, start:end] & ~0x20)  # ASCII upper-case
+            pos = np.clip(np.searchsorted(_MONTH_KEYS, keys, sorter=_MONTH_ORDER), 0, 11)
+            values["month"] = _MONTH_ORDER[pos] + 1
+            ok &= _MONTH_KEYS[_MONTH_ORDER[pos]] == keys
+        else:
+            values[field], valid = number(start, end)
+            ok &= valid
+
+    year = values["year"] if "year" in values else 2000 + values["year2"]
+    month, day = values["month"], values["day"]
+    ok &= (month >= 1) & (month <= 12) & (day >= 1)
+    ok &= (values["hour"] < 24) & (values["minute"] < 60) & (values["second"] < 60)
+
+    # Calendar arithmetic: month start + (day - 1) days, rejecting days past the month end
+    month_index = np.where(ok, (year - 1970) * 12 + month - 1, 0).astype(np.int64)
+    month_start = month_index.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    next_month = (month_index + 1).astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    ok &= day <= next_month - month_start
+
+    seconds = (month_start + day - 1) * 86400 + values["hour"] * 3600 + values["minute"] * 60 + values["second"]
+    times[rows[ok]] = seconds[ok].astype("datetime64[s]")
+    unmatched = np.ones(len(times), dtype=bool)
+    unmatched[rows[ok]] = False
+    return times, unmatched
+
+
+def parse_event_times(values, formats=EVENT_TIME_FORMATS):
+    """
+    Parses timestamp strings into datetime64 with one vectorized pass per format.
+
+    Each format is only tried on the rows the previous formats could not parse,
+    so mixed files cost no more than their share of each layout.
+
+    Parameters:
+        values (array-like): Raw EVENT_TIME / EVENT_DATE / REPORT_DATE values.
+        formats (tuple): strptime formats to try, in order.
+
+    Returns:
+        Series: datetime64[ns] values (NaT where no format matched).
+    """
+    raw = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(raw):
+        return raw
+
+    text = raw.astype(str)
+    times = np.full(len(text), np.datetime64("NaT"), dtype="datetime64[ns]")
+    missing = np.ones(len(text), dtype=bool)
+
+    # Fast path: exact fixed-width layouts decoded with array arithmetic
+    fixed = [fmt for fmt in formats if fmt in FIXED_WIDTH_LAYOUTS]
+    if fixed:
+        codes = _char_codes(text, max(FIXED_WIDTH_LAYOUTS[fmt][0] for fmt in fixed) + 1)
+        for fmt in fixed:
+            rows = np.flatnonzero(missing)
+            if len(rows) == 0:
+                break
+            parsed, unmatched = _parse_fixed_width(codes[rows], fmt)
+            times[rows[~unmatched]] = parsed[~unmatched]
+            missing[rows[~unmatched]] = False
+
+    # Slow path: only the irregular rows left over (padding, single-digit days, other layouts)
+    if missing.any():
+        leftover = text[missing].str.strip()
+        parsed = np.full(len(leftover), np.datetime64("NaT"), dtype="datetime64[ns]")
+        for fmt in formats + ("ISO8601",):  # ISO 8601 is the last resort for re-exported files
+            todo = np.isnat(parsed)
+            if not todo.any():
+                break
+            parsed[todo] = pd.to_datetime(leftover[todo], format=fmt, errors="coerce").to_numpy()
+        times[missing] = parsed
+
+    return pd.Series(times, index=raw.index)
+
+
+def timezone_offset_hours(values):
+    """
+    Converts TIMEZONE values to float hour offsets.
+
+    Accepts numeric offsets ("-4.0", "-5.0", -4) as well as "+02:00"/"-0430"
+    style strings; anything unreadable is treated as UTC (0).
+
+    Parameters:
+        values (array-like): Raw TIMEZONE column.
+
+    Returns:
+        Series: Offset from UTC in hours (float64).
+    """
+    # Offsets repeat heavily, so each distinct value is parsed once and broadcast back
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=True)
+    unique_hours = _offset_hours(pd.Series(uniques, dtype=object)).to_numpy()
+    hours = np.where(codes >= 0, unique_hours[np.maximum(codes, 0)], 0.0)
+    return pd.Series(hours, index=pd.Series(values).index).fillna(0.0)
+
+
+def _offset_hours(raw):
+    """Parses distinct TIMEZONE values to hours (NaN when unreadable)."""
+    hours = pd.to_numeric(raw, errors="coerce").astype(np.float64)
+
+    # Compact "-0430" style offsets come through as -430
+    compact = hours.abs() > 24
+    hours[compact] = np.sign(hours[compact]) * (hours[compact].abs() // 100 + hours[compact].abs() % 100 / 60)
+
+    # Only the rows that are not plain numbers go through the regex
+    missing = hours.isna() & raw.notna()
+    if missing.any():
+        parts = raw[missing].astype(str).str.extract(r"^\s*(?:UTC|GMT)?\s*([+-])?(\d{1,2}):?(\d{2})?\s*$")
+        sign = np.where(parts[0] == "-", -1.0, 1.0)
+        magnitude = pd.to_numeric(parts[1], errors="coerce") + pd.to_numeric(parts[2], errors="coerce").fillna(0) / 60
+        hours[missing] = sign * magnitude.to_numpy()
+
+    return hours
+
+
+def to_utc(local_times, offsets):
+    """
+    Shifts local timestamps to UTC using per-row hour offsets (UTC = local - offset).
+
+    Parameters:
+        local_times (Series): datetime64 local times.
+        offsets (array-like): Offsets from UTC in hours, e.g. -4.0 for UTC-4.
+
+    Returns:
+        Series: Timezone-naive datetime64 values expressed in UTC.
+    """
+    seconds = np.round(timezone_offset_hours(offsets).to_numpy() * 3600).astype(np.int64)
+    return pd.Series(local_times) - pd.to_timedelta(seconds, unit="s").to_numpy()  # Row-aligned by position
+
+
+def normalize_event_times(values, offsets=None, formats=EVENT_TIME_FORMATS):
+    """
+    Parses raw timestamps and, when offsets are given, converts them to UTC.
+
+    This is the single entry point used by the history model and the
+    brute-force detectors so every path agrees on what a timestamp means.
+
+    Parameters:
+        values (array-like): Raw timestamp strings.
+        offsets (array-like): Optional TIMEZONE column aligned with ``values``.
+        formats (tuple): strptime formats to try, in order.
+
+    Returns:
+        Series: datetime64 values (UTC when ``offsets`` is given).
+    """
+    times = parse_event_times(values, formats)
+    if offsets is None:
+        return times
+    return to_utc(times, offsets)
@@ -0,0 +1,183 @@
+import os
+import re
+import pickle
+import numpy as np
+import pandas as pd
+from checkpoint import atomic_write_pickle
+
+# Index of known usernames by their digit-free base, kept next to the history shards
+USERNAME_INDEX_FILE = "username_index.pkl"
+_DIGITS = re.compile(r'\d+')
+USERNAME_PARTS = ["CLEANED_USERNAME", "EXTRACTED_NUMBERS", "DIGIT_RUNS", "DIGIT_LENGTH",
+                  "NUMERIC_VALUE", "DIGIT_POSITION"]
+
+
+def extract_numbers_and_clean(username):
+    """
+    Extracts numerical values from a username and returns the cleaned username.
+
+    Parameters:
+        username (str): The username to process.
+
+    Returns:
+        tuple: (cleaned username, extracted numbers as a concatenated string)
+    """
+    username = str(username)
+    numbers = ''.join(_DIGITS.findall(username))  # Extract numerical values
+    cleaned_id = _DIGITS.sub('', username)  # Remove numbers from username
+    return cleaned_id, numbers
+
+
+def decompose_usernames(usernames):
+    """
+    Splits a column of usernames into typed parts with column-level string operations.
+
+    Usernames repeat heavily in AUTH logs, so each distinct name is decomposed
+    once and the parts are broadcast back to every row.
+
+    Parameters:
+        usernames (Series or list): Raw usernames.
+
+    Returns:
+        DataFrame: Aligned with ``usernames``, with columns
+            CLEANED_USERNAME (str): The name with every digit run removed.
+            EXTRACTED_NUMBERS (str): All digit runs concatenated ("" if none).
+            DIGIT_RUNS (int32): Number of separate digit runs.
+            DIGIT_LENGTH (int32): Total number of digits.
+            NUMERIC_VALUE (float64): EXTRACTED_NUMBERS as a number (NaN if none).
+            DIGIT_POSITION (int32): Offset of the first digit (-1 if none).
+    """
+    usernames = pd.Series(usernames)
+    codes, uniques = pd.factorize(usernames.fillna("").astype(str))  # Missing names decompose as ""
+    names = pd.Series(uniques, dtype=object)
+
+    numbers = names.str.replace(r'\D+', '', regex=True)
+    digit_length = numbers.str.len().to_numpy(np.int32)
+    prefix_length = names.str.len().to_numpy(np.int32) - names.str.replace(r'^\D*', '', regex=True).str.len().to_numpy(np.int32)
+    parts = {
+        "CLEANED_USERNAME": names.str.replace(r'\d+', '', regex=True).to_numpy(object),
+        "EXTRACTED_NUMBERS": numbers.to_numpy(object),
+        "DIGIT_RUNS": names.str.count(r'\d+').to_numpy(np.int32),
+        "DIGIT_LENGTH": digit_length,
+        "NUMERIC_VALUE": pd.to_numeric(numbers.where(digit_length > 0), errors="coerce").to_numpy(np.float64),
+        "DIGIT_POSITION": np.where(digit_length > 0, prefix_length, -1).astype(np.int32),
+    }
+    return pd.DataFrame({column: parts[column][codes] for column in USERNAME_PARTS}, index=usernames.index)
+
+
+class UsernameIndex:
+    """
+    Maps each cleaned base username to the numeric suffixes known for it.
+
+    ``bases[base][numbers]`` is the set of stored users that decompose into
+    ``(base, numbers)``, so finding every known user that shares a base with
+    an attempted username is a dictionary lookup instead of a scan over all
+    users.
+
+    Example:
+        index = UsernameIndex.from_users(["john12", "john7"])
+        index.attacked_users([("john", "99")])  # {"john12", "john7"}
+    """
+
+    def __init__(self):
+        self.bases = {}  # base -> {numbers: {user_id, ...}}
+        self.n_users = 0
+
+    @classmethod
+    def from_users(cls, user_ids):
+        """Builds an index over ``user_ids`` (e.g. ``store.keys()``, which reads no shard)."""
+        index = cls()
+        user_ids = list(user_ids)
+        if not user_ids:
+            return index
+        parts = decompose_usernames(pd.Series(user_ids, dtype=object))
+        for user_id, base, numbers in zip(user_ids, parts["CLEANED_USERNAME"], parts["EXTRACTED_NUMBERS"]):
+            index._insert(user_id, base, numbers)
+        return index
+
+    def __len__(self):
+        return self.n_users
+
+    def __contains__(self, user_id):
+        base, numbers = extract_numbers_and_clean(user_id)
+        return user_id in self.bases.get(base, {}).get(numbers, ())
+
+    def _insert(self, user_id, base, numbers):
+        users = self.bases.setdefault(base, {}).setdefault(numbers, set())
+        if user_id not in users:
+            users.add(user_id)
+            self.n_users += 1
+
+    def add(self, user_id):
+        self._insert(user_id, *extract_numbers_and_clean(user_id))
+
+    def discard(self, user_id):
+        base, numbers = extract_numbers_and_clean(user_id)
+        suffixes = self.bases.get(base)
+        if not suffixes or user_id not in suffixes.get(numbers, ()):
+            return
+        suffixes[numbers].discard(user_id)
+        self.n_users -= 1
+        if not suffixes[numbers]:
+            del suffixes[numbers]
+        if not suffixes:
+            del self.bases[base]
+
+    def sync(self, user_ids, store):
+        """Re-indexes ``user_ids`` (e.g. a store's dirty users) against their presence in ``store``."""
+        for user_id in user_ids:
+            if user_id in store:
+                self.add(user_id)
+            else:
+                self.discard(user_id)
+
+    def attacked_users(self, attempts):
+        """
+        Returns the known users targeted by numeric-value guessing.
+
+        A known user is attacked when an attempt uses the user's base with a
+        different number. Attempts are grouped by base first, so the cost is one
+        lookup per distinct base however many attempts were made.
+
+        Parameters:
+            attempts (iterable): (cleaned username, extracted numbers) pairs.
+
+        Returns:
+            set: The attacked USER_IDs.
+        """
+        tried = {}
+        for base, numbers in attempts:
+            if base in self.bases:
+                tried.setdefault(base, set()).add(numbers)
+
+        attacked = set()
+        for base, numbers_tried in tried.items():
+            for numbers, users in self.bases[base].items():
+                # Only a user whose own number is the single one tried is not attacked
+                if numbers_tried != {numbers}:
+                    attacked.update(users)
+        return attacked
+
+
+def load_username_index(root, user_history=None):
+    """
+    Loads the persisted index from ``root``, rebuilding it if it is missing or stale.
+
+    The index is stale when it covers a different number of users than
+    ``user_history``; rebuilding only needs the store's USER_ID list.
+    """
+    path = os.path.join(root, USERNAME_INDEX_FILE)
+    index = None
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            index = pickle.load(f)
+    if user_history is not None and (index is None or len(index) != len(user_history)):
+        print(f"🔄 Rebuilding username index over {len(user_history)} users...")
+        index = UsernameIndex.from_users(user_history.keys())
+        save_username_index(index, root)
+    return index if index is not None else UsernameIndex()
+
+
+def save_username_index(index, root):
+    """Saves the index next to the history shards."""
+    atomic_write_pickle(index, os.path.join(root, USERNAME_INDEX_FILE))